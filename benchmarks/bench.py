@@ -0,0 +1,258 @@
+import sys
+import os
+import io
+import json
+import time
+import argparse
+import functools
+import platform
+import datetime
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+import numpy as np
+import scipy
+import skimage, skimage.util, skimage.feature
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(REPO_DIR, "features"))
+sys.path.append(os.path.join(REPO_DIR, "spatial_transforms"))
+import config
+import extraction
+import glcm
+import histograms
+from dataset import Dataset
+import gen_dataset
+import transforms
+import features
+import synthetic
+
+"""
+Benchmark suite on synthetic images (see synthetic.py), writing machine-readable JSON.
+
+Each benchmark is timed (best and mean wall time over --repeats runs, after one warm-up run), and run once more
+under tracemalloc to get its peak traced memory (numpy arrays included; memory allocated directly by C code
+outside numpy, e.g. inside some scipy routines, is not traced).
+
+    python benchmarks/bench.py --out before.json
+    ... change something ...
+    python benchmarks/bench.py --out after.json
+    python benchmarks/bench.py --compare before.json after.json
+"""
+
+BENCHMARKS = []
+
+def benchmark(group: str):
+    """
+        Registers a benchmark generator: called with the context dict, it yields
+        (name, fn, items, params), where fn() processes `items` images (or paths, rows, ...).
+    """
+    def register(gen):
+        BENCHMARKS.append((group, gen))
+        return gen
+    return register
+
+def measure(fn, repeats: int) -> dict:
+    fn() ## warm-up (imports, lookup tables, caches)
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best_s": min(times), "mean_s": sum(times) / len(times), "peak_traced_bytes": peak}
+
+@contextlib.contextmanager
+def quiet():
+    ## the measured functions print progress (and tqdm bars)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+@benchmark("gen_dataset")
+def bench_gen_dataset(ctx):
+    for (name, new_root, T, desc) in gen_dataset.init_transforms(""):
+        def run(T=T):
+            for img in ctx["images"]:
+                ## same path as gen_dataset.transform_file
+                out = gen_dataset.apply_transform_ubyte(T, img)
+                if out is None:
+                    gen_dataset.apply_transform(T, skimage.util.img_as_float(img))
+        yield new_root.lstrip("_"), run, len(ctx["images"]), {"desc": desc}
+
+@benchmark("transforms")
+def bench_transforms(ctx):
+    N, sigma = 10, 5.0
+    for method in ("separable", "fft"):
+        def run(method=method):
+            for img in ctx["float_images"]:
+                transforms.GaussianFilter.apply_gaussian_filter(img, N=N, sigma=sigma, method=method)
+        yield f"gaussian_{method}", run, len(ctx["images"]), {"N": N, "sigma": sigma}
+    def gamma():
+        for img in ctx["images"]:
+            transforms.gamma_correction_ubyte(img, gamma=0.7, c=1.5)
+    yield "gamma_correction_ubyte", gamma, len(ctx["images"]), {"gamma": 0.7, "c": 1.5}
+
+@benchmark("features")
+def bench_color_features(ctx):
+    def color_transformed():
+        for img in ctx["images"]:
+            features.color_transformed(img)
+    yield "color_transformed", color_transformed, len(ctx["images"]), {}
+    def gen_opponent():
+        with quiet(): ## low contrast warnings of imsave
+            for img in ctx["images"]:
+                features.gen_opponent(img, path=os.path.join(ctx["tmp"], "opponent.jpg"))
+    yield "gen_opponent", gen_opponent, len(ctx["images"]), {}
+
+@benchmark("extraction")
+def bench_extraction(ctx):
+    images, grays, shape = ctx["images"], ctx["grays"], ctx["shape"]
+    steps = {
+        "preprocess": (functools.partial(extraction.preprocess, shape=shape), images),
+        "LBP": (extraction.lbp, grays),
+        "GLCM": (extraction.glcm, grays),
+        "sobel": (extraction.sobel, grays),
+        "haralick": (extraction.haralick, ctx["glcms"]),
+        "extract": (functools.partial(extraction.extract, shape=shape), images),
+    }
+    for name, (f, inputs) in steps.items():
+        def run(f=f, inputs=inputs):
+            for x in inputs:
+                f(x)
+        yield name, run, len(inputs), {"SHAPE": list(shape)}
+
+@benchmark("glcm")
+def bench_glcm(ctx):
+    ## batched engine (see glcm.py) against skimage, on the same stack of preprocessed images
+    stack = np.stack(ctx["grays"])
+    params = {"SHAPE": list(stack.shape[1:]), "offsets": len(config.DISTANCES) * len(config.ANGLES)}
+    def per_image():
+        for gray in stack:
+            skimage.feature.graycomatrix(gray, config.DISTANCES, config.ANGLES)
+    yield "skimage_per_image", per_image, len(stack), params
+    for method in ("skimage", "bincount"):
+        yield f"batched_{method}", lambda method=method: glcm.graycomatrix(stack, method=method), len(stack), params
+
+@benchmark("dataset")
+def bench_dataset(ctx):
+    root = ctx["tree"]
+    n = ctx["args"].tree_files
+    yield "walk_scan", lambda: list(Dataset(root, use_manifest=False).walk()), n, {}
+    Dataset(root).paths() ## writes the manifest
+    yield "len_manifest", lambda: len(Dataset(root)), n, {}
+    ds = Dataset(root)
+    idx = np.random.default_rng(0).integers(0, len(ds), 1000).tolist()
+    def getitem():
+        for i in idx:
+            ds[i]
+    yield "getitem", getitem, len(idx), {}
+    yield "getitem_list", lambda: ds[idx], len(idx), {}
+
+@benchmark("histograms")
+def bench_histograms(ctx):
+    lbp_path = os.path.join(ctx["tmp"], "bench_LBP.npy")
+    rows = ctx["args"].hist_rows
+    lbps = [extraction.lbp(gray).reshape(-1) for gray in ctx["grays"]]
+    np.save(lbp_path, np.stack([lbps[i % len(lbps)] for i in range(rows)]))
+    def run():
+        with quiet():
+            histograms.gen_lbp_histograms([lbp_path], os.path.join(ctx["tmp"], "bench_LBP_histograms.npz"))
+    yield "gen_lbp_histograms", run, rows, {"rows": rows}
+
+def git_commit() -> str|None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metadata(args) -> dict:
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "skimage": skimage.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "shape": list(args.shape),
+        "args": vars(args),
+    }
+
+def run(args) -> dict:
+    shape = tuple(args.shape)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {args.images} synthetic {shape} images and a tree of {args.tree_files} files in {tmp}")
+        images = [synthetic.synthetic_image(shape, seed=i) for i in range(args.images)]
+        ## the features are extracted at the same resolution (e.g. the input size of the model)
+        grays = [extraction.preprocess(img, shape) for img in images]
+        synthetic.write_empty_tree(os.path.join(tmp, "tree"), args.tree_files)
+        ctx = {
+            "args": args,
+            "shape": shape,
+            "tmp": tmp,
+            "tree": os.path.join(tmp, "tree"),
+            "images": images,
+            "float_images": [skimage.util.img_as_float(img) for img in images],
+            "grays": grays,
+            "glcms": [extraction.glcm(gray) for gray in grays],
+        }
+
+        results = []
+        for group, gen in BENCHMARKS:
+            for name, fn, items, params in gen(ctx):
+                full_name = f"{group}.{name}"
+                if args.filter and not any(f in full_name for f in args.filter):
+                    continue
+                res = measure(fn, args.repeats)
+                res = {"name": full_name, "items": items, "items_per_s": items / res["best_s"], **res, "params": params}
+                results.append(res)
+                print(f"{full_name:<40} {res['best_s']:9.4f}s  {res['items_per_s']:10.1f} items/s  {res['peak_traced_bytes'] / 2**20:9.1f} MiB peak")
+    return {"meta": metadata(args), "results": results}
+
+def compare(base_path: str, new_path: str):
+    """
+        Prints the speedup (base best time / new best time) and peak memory ratio of every benchmark in both files.
+    """
+    with open(base_path) as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"{'benchmark':<40} {'base (s)':>9} {'new (s)':>9} {'speedup':>8} {'memory':>8}")
+    for name in base:
+        if name not in new:
+            continue
+        b, n = base[name], new[name]
+        mem = n["peak_traced_bytes"] / b["peak_traced_bytes"] if b["peak_traced_bytes"] else float("nan")
+        print(f"{name:<40} {b['best_s']:9.4f} {n['best_s']:9.4f} {b['best_s'] / n['best_s']:7.2f}x {mem:7.2f}x")
+
+def init_parser():
+    parser = argparse.ArgumentParser(description="Benchmark transforms, features and the dataset layer on synthetic images")
+    parser.add_argument("--out", type=str, default=None, help="JSON output file (default: bench_<commit>.json)")
+    parser.add_argument("--images", type=int, default=4, help="Number of synthetic images per benchmark")
+    parser.add_argument("--shape", type=int, nargs=2, default=list(synthetic.SHAPE), metavar=("H", "W"),
+                        help="Size of the synthetic images, and resolution the features are extracted at")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per benchmark (after one warm-up run)")
+    parser.add_argument("--tree-files", type=int, default=5000, help="Number of files in the synthetic tree for the Dataset benchmarks")
+    parser.add_argument("--hist-rows", type=int, default=32, help="Number of LBP rows for the histogram benchmark")
+    parser.add_argument("--filter", nargs="+", default=None, help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), default=None, help="Compare two result files and exit")
+    return parser
+
+if __name__ == "__main__":
+    args = init_parser().parse_args()
+    if args.compare is not None:
+        compare(*args.compare)
+        sys.exit(0)
+
+    report = run(args)
+    out = args.out if args.out is not None else f"bench_{(report['meta']['commit'] or 'unknown')[:12]}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results in {out}")
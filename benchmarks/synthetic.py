@@ -0,0 +1,92 @@
+import os
+import argparse
+import numpy as np
+import scipy.ndimage
+import skimage.io, skimage.util
+
+"""
+Synthetic, glomerulus-like RGB images (the real dataset is private): pink, textured tissue background,
+a roughly elliptical glomerular tuft surrounded by a pale Bowman's space, and dark purple nuclei
+(dense inside the tuft). Only meant to have realistic sizes, dtypes and intensity statistics for benchmarking.
+"""
+
+SHAPE = (768, 1024)
+BACKGROUND = (0.93, 0.72, 0.80)
+TUFT = (0.78, 0.45, 0.68)
+BOWMAN = (0.97, 0.90, 0.93)
+NUCLEUS = (0.30, 0.15, 0.50)
+
+def synthetic_image(shape: tuple[int, int] = SHAPE, seed: int = 0) -> np.ndarray:
+    """
+        (H, W, 3) uint8 image.
+    """
+    rng = np.random.default_rng(seed)
+    H, W = shape
+    img = np.empty((H, W, 3), dtype=np.float64)
+    img[:] = BACKGROUND
+
+    ## low-frequency tissue texture
+    coarse = rng.random((H // 16 + 2, W // 16 + 2))
+    texture = scipy.ndimage.zoom(coarse, 16, order=1)[:H, :W]
+    img *= (0.85 + 0.15 * texture)[..., None]
+
+    ## glomerulus (ellipse) and Bowman's space around it
+    yy, xx = np.mgrid[0:H, 0:W]
+    cy, cx = H * (0.35 + 0.3 * rng.random()), W * (0.35 + 0.3 * rng.random())
+    r = min(H, W) * (0.25 + 0.1 * rng.random())
+    d = ((yy - cy) / r) ** 2 + ((xx - cx) / (1.2 * r)) ** 2
+    tuft = d < 1.0
+    img[tuft] = 0.5 * img[tuft] + 0.5 * np.array(TUFT)
+    img[(d >= 1.0) & (d < 1.2)] = BOWMAN
+
+    ## nuclei: blurred point process, denser inside the tuft
+    points = np.zeros((H, W))
+    n = H * W // 1000
+    ys, xs = rng.integers(0, H, n), rng.integers(0, W, n)
+    points[ys, xs] = np.where(tuft[ys, xs], 1.0, 0.3)
+    nuclei = np.clip(60.0 * scipy.ndimage.gaussian_filter(points, 2.5), 0.0, 1.0)[..., None]
+    img = (1.0 - nuclei) * img + nuclei * np.array(NUCLEUS)
+
+    img += rng.normal(0.0, 0.02, img.shape)
+    return skimage.util.img_as_ubyte(np.clip(img, 0.0, 1.0))
+
+def write_dataset(root: str,
+                  n: int,
+                  shape: tuple[int, int] = SHAPE,
+                  seed: int = 0,
+                  classes: tuple[str, ...] = ("Normal", "Crescente"),
+                  splits: tuple[str, ...] = ("treino", "teste"),
+                  stains: tuple[str, ...] = ("AZAN", "HE")) -> list[str]:
+    """
+        Writes n synthetic JPEGs under root, spread over the same folder layout as the real dataset
+        (<class>/<split>/<stain>/img (i).jpg). Returns the written paths.
+    """
+    folders = [os.path.join(root, c, s, t) for c in classes for s in splits for t in stains]
+    paths = []
+    for i in range(n):
+        folder = folders[i % len(folders)]
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"img ({i // len(folders)}).jpg")
+        skimage.io.imsave(path, synthetic_image(shape, seed + i), check_contrast=False)
+        paths.append(path)
+    return paths
+
+def write_empty_tree(root: str, n: int, files_per_dir: int = 100) -> None:
+    """
+        n empty .jpg files (for benchmarking the path handling of Dataset, which never reads them).
+    """
+    for i in range(n):
+        folder = os.path.join(root, f"class{i // (10 * files_per_dir)}", f"dir{(i // files_per_dir) % 10}")
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, f"img ({i}).jpg"), "wb").close()
+
+if __name__ == "__main__":
+    ## e.g. a fake dataset to run the real pipelines on: python synthetic.py /tmp/Glomerulus 64
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset of glomerulus-like JPEGs")
+    parser.add_argument("root", type=str)
+    parser.add_argument("n", type=int)
+    parser.add_argument("--shape", type=int, nargs=2, default=list(SHAPE), metavar=("H", "W"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = write_dataset(args.root, args.n, tuple(args.shape), args.seed)
+    print(f"Wrote {len(paths)} images under {args.root}")
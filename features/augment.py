@@ -0,0 +1,100 @@
+import sys
+import numpy as np
+import skimage.util
+import config
+import profiling
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+import gen_dataset
+
+"""
+Streaming augmentation: the transforms of spatial_transforms/gen_dataset.py (init_transforms) are applied
+in memory to each decoded original image and composed directly with feature extraction, instead of writing
+an augmented copy of the dataset as JPEGs and extracting features from it afterwards.
+
+Augmentations are named after the suffix of the folder gen_dataset.py would create
+(e.g. "gamma1" for Glomerulus_gamma1), and ORIGINAL stands for the unaugmented image.
+Features of an augmentation are those of the augmented image before JPEG encoding (no lossy re-encoding).
+"""
+
+ORIGINAL = "original"
+
+_augmentations = None
+
+def augmentations() -> dict:
+    """
+        Maps each augmentation name to its transform (float image -> float image, some with an uint8 fast path).
+        Built lazily (in each worker process), since the transforms are lambdas and can't be pickled.
+    """
+    global _augmentations
+    if _augmentations is None:
+        _augmentations = {new_root.lstrip("_"): T for (name, new_root, T, desc) in gen_dataset.init_transforms("")}
+    return _augmentations
+
+def names() -> list[str]:
+    return [ORIGINAL, *augmentations()]
+
+def output_prefix(dataset_name: str, name: str) -> str:
+    ## same prefix as running generate_features.py on the folder created by gen_dataset.py
+    return dataset_name if name == ORIGINAL else f"{dataset_name}_{name}"
+
+def params(aug_names: list[str]) -> dict:
+    """
+        Every parameter of gen_dataset.py that affects the augmented images (used e.g. as feature cache key).
+    """
+    return {
+        "augment": list(aug_names),
+        "sigma": gen_dataset.sigma,
+        "truncate": gen_dataset.truncate,
+        "gammas": list(gen_dataset.gammas),
+        "consts": list(gen_dataset.consts),
+        "hist_bins": gen_dataset.hist_bins,
+        "ksize": gen_dataset.ksize,
+        "laplace_const": gen_dataset.laplace_const,
+    }
+
+class AugmentedExtract:
+    """
+        Picklable transform (for Dataset.lazy_apply) that applies every augmentation in aug_names to a decoded
+        (uint8) image and extracts the features of each augmented image with extract.
+        Returns a flat dict {"<augmentation>:<feature>": row} (see split).
+    """
+    def __init__(self, aug_names: list[str], extract, tile: int|None = None):
+        for name in aug_names:
+            if name not in names():
+                raise ValueError(f"Invalid augmentation {name}")
+        self.aug_names = list(aug_names)
+        self.extract = extract
+        self.tile = tile
+
+    def __call__(self, img: np.ndarray) -> dict[str, np.ndarray]:
+        rows = {}
+        img_float = None
+        for name in self.aug_names:
+            if name == ORIGINAL:
+                augmented = img
+            else:
+                T = augmentations()[name]
+                with profiling.stage(f"augment:{name}") as record:
+                    if self.tile is not None:
+                        augmented = gen_dataset.apply_transform_tiled(T, img, self.tile) ## no full-size float copy
+                    else:
+                        augmented = gen_dataset.apply_transform_ubyte(T, img) ## lookup table, if T is a point transform
+                    if augmented is None:
+                        if img_float is None:
+                            img_float = skimage.util.img_as_float(img) ## shared by all float augmentations
+                        augmented = gen_dataset.apply_transform(T, img_float)
+                    record["out"] = augmented
+            for feature, row in profiling.timed(f"extract:{name}", self.extract, augmented).items():
+                rows[f"{name}:{feature}"] = row
+        return rows
+
+def split(rows: dict[str, np.ndarray]) -> dict[str, dict[str, np.ndarray]]:
+    """
+        {"<augmentation>:<feature>": row} -> {augmentation: {feature: row}}
+    """
+    out = {}
+    for key, row in rows.items():
+        name, feature = key.split(":", 1)
+        out.setdefault(name, {})[feature] = row
+    return out
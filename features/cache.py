@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+CACHE_VERSION = 1
+
+class FeatureCache:
+    """
+        Content-addressed, on-disk cache of per-image feature rows.
+
+        Each entry is a .npz file holding the dict of rows extracted from one image, keyed by the
+        SHA-256 of the image file contents together with the extraction parameters (params).
+        Renamed or copied images are therefore still hits, while changed images or parameters are misses.
+        Entries are written atomically, so several worker processes (and interrupted runs) can share a cache.
+
+        The total size is bounded by max_bytes: evict() removes the least recently used entries
+        (hits refresh the entry mtime).
+    """
+    def __init__(self,
+                 root: str,
+                 params: dict,
+                 *,
+                 max_bytes: int|None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.params_digest = hashlib.sha256(json.dumps({"version": CACHE_VERSION, **params}, sort_keys=True, default=str).encode()).hexdigest()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, filepath: str) -> str:
+        h = hashlib.sha256(self.params_digest.encode())
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def key_array(self, arr: np.ndarray) -> str:
+        """
+            Key of an in-memory input image (e.g. a row of the preprocessed tensor, see preprocessed.py).
+        """
+        h = hashlib.sha256(self.params_digest.encode())
+        h.update(f"{arr.dtype}{arr.shape}".encode())
+        h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".npz")
+
+    def get(self, key: str) -> dict[str, np.ndarray]|None:
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                row = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError, EOFError):
+            return None ## missing (or truncated) entry
+        os.utime(path) ## mark as recently used
+        return row
+
+    def put(self, key: str, row: dict[str, np.ndarray]):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **row)
+        os.replace(tmp_path, path) ## atomic
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for cwd, _, files in os.walk(self.root):
+            for f in files:
+                if f.endswith(".npz"):
+                    st = os.stat(os.path.join(cwd, f))
+                    yield os.path.join(cwd, f), st.st_mtime, st.st_size
+
+    def evict(self) -> int:
+        """
+            Removes least recently used entries until the cache fits in max_bytes.
+            Returns the number of entries removed.
+        """
+        if self.max_bytes is None:
+            return 0
+        entries = sorted(self._entries(), key=lambda e: e[1]) ## oldest first
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
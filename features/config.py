@@ -1,3 +1,4 @@
+import os
 import numpy as np
 
 IGNORE_DIRS = ["Crescente"]
@@ -8,3 +9,6 @@ DISTANCES = [1]
 ANGLES = [0.0, np.pi * 0.25, np.pi * 0.5, np.pi * 0.75, np.pi]
 MAXL = 2**8 - 1
 CUTOFF = float('inf') ## NOTE in final execution it should always be infinity (float('inf'))
+
+## image transforms (augmentations) and shared helpers live in the sibling folder spatial_transforms
+SPATIAL_TRANSFORMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "spatial_transforms")
@@ -1,57 +1,160 @@
 import shutil
 import skimage
-import skimage.util, skimage.io
+import skimage.util, skimage.io, skimage.color
+import numpy as np
+from PIL import Image
 import os
+import json
 import tqdm
+import functools
+import sys
+import config
+import profiling
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+from parallel import OrderedPool, WriteBehind
+
+MANIFEST_VERSION = 1
+
+def imread(filepath: str, decode_size: tuple[int, int]|None = None) -> np.ndarray:
+    """
+        skimage.io.imread(filepath), or with decode_size (H, W) a reduced-resolution decode of JPEG files:
+        libjpeg decodes straight at 1/2, 1/4 or 1/8 scale (scaled IDCT, through PIL's Image.draft), choosing the smallest
+        scale whose result is still at least decode_size, so the resize that follows starts from a much smaller image.
+        Other formats are decoded at full size. The pixels differ slightly from a full decode + resize (opt-in).
+    """
+    if decode_size is not None:
+        with Image.open(filepath) as img:
+            if img.format == "JPEG":
+                img.draft(img.mode, (decode_size[1], decode_size[0])) ## PIL sizes are (W, H)
+                return np.array(img)
+    return skimage.io.imread(filepath)
 
 class Dataset:
+    """
+        Image dataset rooted at absolute_path.
+
+        The (sorted, stable) list of image paths is built once and persisted as a manifest
+        next to the dataset ("<absolute_path>.manifest.json"). The manifest records the mtime of every
+        directory in the tree and is rebuilt only when one of them changes (a file or subdirectory was
+        added, removed or renamed), so len(), indexing and slicing don't walk the tree again.
+
+        With decode_size (H, W), images are decoded at reduced resolution when the codec supports it (see imread),
+        for pipelines that downscale them to decode_size anyway.
+    """
     def __init__(self, 
             absolute_path: str, 
             ignore_dirs: list[str] = [], 
-            allowed_extensions: list[str] = ["jpg", "png", "JPG", "jpeg"]):
+            allowed_extensions: list[str] = ["jpg", "png", "JPG", "jpeg"],
+            *,
+            use_manifest: bool = True,
+            decode_size: tuple[int, int]|None = None):
         self.path = absolute_path
         self.ignore = ignore_dirs
         self.allowed_extensions = allowed_extensions
+        self.use_manifest = use_manifest
+        self.decode_size = tuple(decode_size) if decode_size is not None else None
+        self._paths = None
 
-    def walk(self):
+    @property
+    def manifest_path(self) -> str:
+        return os.path.normpath(self.path) + ".manifest.json"
+
+    def _scan(self) -> tuple[list[str], dict[str, int]]:
+        """
+            Walks the directory tree, returning the sorted relative paths of all images
+            and the mtime (in ns) of every directory visited.
+        """
+        paths = []
+        dir_mtimes = {}
         for cwd, cwd_subdirs, files in os.walk(self.path):
+            dir_mtimes[os.path.relpath(cwd, self.path)] = os.stat(cwd).st_mtime_ns
             if (any([cwd.endswith(i) for i in self.ignore])):
                 continue
             
             for f in files:
                 if (not any([f.endswith(ext) for ext in self.allowed_extensions])):
                     continue 
-                yield os.path.join(cwd, f) 
+                paths.append(os.path.relpath(os.path.join(cwd, f), self.path))
+        return sorted(paths), dir_mtimes
 
+    def _load_manifest(self) -> list[str]|None:
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get("version") != MANIFEST_VERSION
+                or manifest.get("ignore") != list(self.ignore)
+                or manifest.get("allowed_extensions") != list(self.allowed_extensions)):
+            return None
+        ## invalidated by any change of directory mtimes (new/removed/renamed entries)
+        for rel_dir, mtime in manifest["dir_mtimes"].items():
+            try:
+                if (os.stat(os.path.join(self.path, rel_dir)).st_mtime_ns != mtime):
+                    return None
+            except OSError:
+                return None
+        return manifest["paths"]
+
+    def _save_manifest(self, paths: list[str], dir_mtimes: dict[str, int]):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "ignore": list(self.ignore),
+            "allowed_extensions": list(self.allowed_extensions),
+            "dir_mtimes": dir_mtimes,
+            "paths": paths,
+        }
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path) ## atomic
+        except OSError:
+            ## e.g. read-only location: keep the manifest in memory only
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def paths(self) -> list[str]:
+        """
+            Absolute paths of all images, in walk() order (loaded from the manifest or built on first use).
+        """
+        if self._paths is None:
+            rel_paths = self._load_manifest() if self.use_manifest else None
+            if rel_paths is None:
+                rel_paths, dir_mtimes = self._scan()
+                if self.use_manifest:
+                    self._save_manifest(rel_paths, dir_mtimes)
+            self._paths = [os.path.join(self.path, p) for p in rel_paths]
+        return self._paths
+
+    def refresh(self):
+        """
+            Forgets the in-memory path list, so that the manifest is checked (and possibly rebuilt) again.
+        """
+        self._paths = None
+
+    def walk(self):
+        yield from self.paths()
 
     def __len__(self):
-        ## walk over directory
-        cnt = 0
-        for f in self.walk():
-            cnt += 1
-        return cnt        
+        return len(self.paths())
 
     def __getitem__(self, i):
         if (isinstance(i, tuple) or isinstance(i, list)):
-            s = sorted(i)[::-1]
-            path_list = []
-            for j, path in enumerate(self.walk()):
-                if (s == []):
-                    break
-                elif (j == s[-1]):
-                    path_list.append(path)
-                    s.pop()
-        else:
-            for j, path in enumerate(self.walk()):
-                if (j == i):
-                    return path
+            paths = self.paths()
+            return [paths[j] for j in i]
+        return self.paths()[i] ## int or slice
         
     def load(self,
              *,
             as_gray: bool = False):
         for path in self.walk():
-            img = skimage.io.imread(path, as_gray=as_gray)
-            yield img
+            if self.decode_size is None:
+                yield skimage.io.imread(path, as_gray=as_gray)
+                continue
+            img = imread(path, self.decode_size)
+            yield skimage.color.rgb2gray(img) if (as_gray and img.ndim == 3) else img
 
     def copy_directory_struct(self, new_path: str, no_files: bool = True):
         ignore_files = lambda directory_prefix, files: [f for f in files if os.path.isfile(os.path.join(directory_prefix, f))]
@@ -74,59 +177,85 @@ class Dataset:
             T_list: list|tuple,
             *,
             as_float: bool = False,
-            warn_contrast: bool = False):
+            warn_contrast: bool = False,
+            workers: int = 1,
+            writers: int = 4,
+            profiler: profiling.Profiler|None = None):
+        """
+            Applies T_list (left-to-right) to every image and saves the result (as uint8) under new_root,
+            with the same relative path (see copy_directory_struct).
+            With workers > 1 the transforms run in a process pool (T_list must then be picklable),
+            and encoding/saving always runs on `writers` write-behind threads.
+            With a profiler (see profiling.py), decoding, each transform and saving are timed.
+        """
+        transform = functools.partial(_load_and_apply, T_list=[*T_list, skimage.util.img_as_ubyte], as_float=as_float,
+                                      profile=profiler is not None, decode_size=self.decode_size) ## uint8 is necessary for saving
+        save = skimage.io.imsave if profiler is None else functools.partial(profiler.timed, "imsave", skimage.io.imsave)
+        with OrderedPool(workers) as pool, WriteBehind(threads=writers, max_pending=4 * max(workers, writers)) as writer:
+            for cwd, cwd_subdirs, files in os.walk(self.path):
+                if (any([cwd.endswith(i) for i in self.ignore])):
+                    continue
 
-        for cwd, cwd_subdirs, files in os.walk(self.path):
-            if (any([cwd.endswith(i) for i in self.ignore])):
-                continue
+                filepaths = [os.path.join(cwd, file) for file in files if any([file.endswith(ext) for ext in self.allowed_extensions])]
+                results = pool.imap(transform, filepaths)
 
-            ## use tqdm progress bar if in leaf directory (no other subdirectories), which means the images are being created
-            if cwd_subdirs == []: 
-                progress_bar_iterable = tqdm(files)
-                print(f"Creating folder {cwd.replace(self.path, new_root)}")
-            else:
-                progress_bar_iterable = files
-            
-            for file in progress_bar_iterable: ## use progress bar
-                if not any([file.endswith(ext) for ext in self.allowed_extensions]):
-                    continue
-                filepath = os.path.join(cwd, file)
-                img = skimage.io.imread(filepath)
-                if (as_float):
-                    img = skimage.utils.img_as_float(img)
+                ## use tqdm progress bar if in leaf directory (no other subdirectories), which means the images are being created
+                if cwd_subdirs == []: 
+                    results = tqdm.tqdm(results, total=len(filepaths))
+                    print(f"Creating folder {cwd.replace(self.path, new_root)}")
                 
-                new_img = img
-                ## apply left-to-right
-                for transform in T_list:
-                    new_img = transform(new_img)
-                new_img = skimage.util.img_as_ubyte(new_img) ## necessary for saving
-                    
-                new_filepath = filepath.replace(self.path, new_root, 1)
-                skimage.io.imsave(new_filepath, new_img, check_contrast=warn_contrast)
+                for new_img, filepath in zip(results, filepaths): ## use progress bar
+                    if profiler is not None:
+                        new_img = profiler.unwrap(new_img)
+                    new_filepath = filepath.replace(self.path, new_root, 1)
+                    writer.submit(save, new_filepath, new_img, check_contrast=warn_contrast)
 
     def lazy_apply(self, 
                    T_list: list|tuple,
                    *,
-                   as_float: bool = False):
-        for cwd, cwd_subdirs, files in os.walk(self.path):
-            if (any([cwd.endswith(i) for i in self.ignore])):
-                continue
+                   n: int|None = None,
+                   as_float: bool = False,
+                   workers: int = 1,
+                   cache = None,
+                   profiler: profiling.Profiler|None = None):
+        """
+            Lazily applies T_list (left-to-right) to every image (the first n only), in walk() order.
+            With workers > 1 images are spread over a process pool (T_list must then be picklable,
+            i.e. made of module-level functions), but results are still yielded in walk() order.
+            With a cache (see cache.FeatureCache, whose params must describe T_list), results of images
+            already processed are read back from the cache instead of being recomputed.
+            With a profiler (see profiling.py), decoding, cache accesses and each transform are timed.
+        """
+        apply = functools.partial(_load_and_apply, T_list=T_list, as_float=as_float, cache=cache, profile=profiler is not None,
+                                  decode_size=self.decode_size)
+        with OrderedPool(workers) as pool:
+            ## images past n are never submitted to the pool
+            for res in pool.imap(apply, self.paths()[:n]): # lazy return (returns generator)
+                yield res if profiler is None else profiler.unwrap(res)
 
-            ## use tqdm progress bar if in leaf directory (no other subdirectories), which means the images are being created
+def _load_and_apply(filepath: str, T_list: list|tuple, as_float: bool = False, cache = None, profile: bool = False,
+                    decode_size: tuple[int, int]|None = None):
+    if profile:
+        ## profiled in this process, stats returned along with the result (see Profiler.unwrap)
+        with profiling.collect() as profiler:
+            new_img = _load_and_apply(filepath, T_list, as_float, cache, decode_size=decode_size)
+        return new_img, profiler.stats
 
-            for file in files: ## use progress bar
-                if not any([file.endswith(ext) for ext in self.allowed_extensions]):
-                    continue
-                
-                filepath = os.path.join(cwd, file)
-                img = skimage.io.imread(filepath)
-                if as_float:
-                    img = skimage.util.img_as_float(img)
-          
-                ## apply left-to-right
-                new_img = img
-                for transform in T_list:
-                    # print(transform, new_img.dtype) # TODO REMOVE
-                    new_img = transform(new_img)
-                
-                yield new_img # lazy return (returns generator)
+    if cache is not None:
+        key = profiling.timed("cache_key", cache.key, filepath)
+        cached = profiling.timed("cache_get", cache.get, key)
+        if cached is not None:
+            return cached
+
+    img = profiling.timed("imread", imread, filepath, decode_size)
+    if as_float:
+        img = profiling.timed("img_as_float", skimage.util.img_as_float, img)
+
+    ## apply left-to-right
+    new_img = img
+    for transform in T_list:
+        new_img = profiling.timed(profiling.stage_name(transform), transform, new_img)
+
+    if cache is not None:
+        profiling.timed("cache_put", cache.put, key, new_img)
+    return new_img
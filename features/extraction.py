@@ -0,0 +1,259 @@
+import sys
+import skimage
+import skimage.feature, skimage.filters, skimage.color, skimage.transform, skimage.util, skimage.exposure
+import scipy.ndimage
+import numpy as np
+import config
+import profiling
+from glcm import graycoprops, graycomatrix_tiled
+import histograms
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+import tiling
+
+"""
+Fused (single-decode) feature extraction.
+
+Each image is decoded and preprocessed (grayscale, resize to config.SHAPE or a given shape, img_as_ubyte) exactly once,
+and every feature (LBP, GLCM, Sobel and GLCM properties such as contrast) is computed from that same
+preprocessed image. The outputs are byte-identical to applying each transform in a separate pass over the dataset.
+
+With a tile size (tile=...), every stage runs tile by tile with the halo it needs (see spatial_transforms/tiling.py),
+so large input images never get a full-size float copy; the outputs are the same bytes.
+"""
+
+## Haralick properties computed from each GLCM by default (see glcm.graycoprops; the others on request, see --props)
+PROPS = ("contrast",)
+## bins of the per-image LBP histograms (see histograms.py)
+LBP_HIST_BINS = 256
+## halos of the tiled stages: LBP samples a circle of radius R (bilinear interpolation), Sobel is a 3 x 3 kernel
+LBP_HALO = int(np.ceil(config.R)) + 1
+SOBEL_HALO = 1
+
+def to_gray(img: np.ndarray) -> np.ndarray:
+    ## map to grayscale (if not in grayscale)
+    if (len(img.shape) == 3 and img.shape[-1] == 3):
+        return skimage.color.rgb2gray(img)
+    return img
+
+def preprocess(img: np.ndarray, shape: tuple[int, int] = config.SHAPE, tile: int|None = None) -> np.ndarray:
+    """
+        Grayscale + resize to shape (by default config.SHAPE) + conversion to uint8.
+        Features are computed at this resolution, so a smaller shape (e.g. the input size of the model) directly
+        reduces extraction time and storage.
+        rgb2gray uses float coeficients, so the resulting image is float. Also, skimage "resize" uses interpolation (producing float image)
+    """
+    if tile is not None:
+        return profiling.timed("preprocess_tiled", preprocess_tiled, img, shape, tile)
+    gray = profiling.timed("rgb2gray", to_gray, img)
+    resized = profiling.timed("resize", skimage.transform.resize, gray, shape)
+    return profiling.timed("img_as_ubyte", skimage.util.img_as_ubyte, resized)
+
+def preprocess_tiled(img: np.ndarray, shape: tuple[int, int], tile: int = tiling.TILE) -> np.ndarray:
+    """
+        preprocess(img, shape) computed by output tiles: for each one, only the input region it is interpolated from
+        (plus the anti-aliasing halo) is converted to gray float and filtered. Follows skimage.transform.resize step by step
+        (Gaussian anti-aliasing with sigma = (factor - 1) / 2, linear interpolation at (i + 0.5) * factor - 0.5,
+        clipping to the input range), so the result is the same.
+    """
+    in_shape = img.shape[:2]
+    factors = np.divide(in_shape, shape)
+    anti_aliasing = any(out < size for out, size in zip(shape, in_shape))
+    sigma = np.maximum(0, (factors - 1) / 2)
+    halo = [tiling.gaussian_radius(s) + 1 if anti_aliasing else 1 for s in sigma]
+
+    ## resize clips its output to the range of the whole (gray) input
+    lo, hi = np.inf, -np.inf
+    for r0, r1, c0, c1 in tiling.tiles(in_shape, tile):
+        gray = skimage.util.img_as_float(to_gray(img[r0:r1, c0:c1]))
+        lo, hi = min(lo, gray.min()), max(hi, gray.max())
+
+    ## output tiles are sized so that the input region each one reads is about tile x tile
+    out = np.empty(shape, dtype=np.uint8)
+    for r0, r1, c0, c1 in tiling.tiles(shape, max(1, int(tile / max(1.0, factors.max())))):
+        rows = (np.arange(r0, r1) + 0.5) * factors[0] - 0.5
+        cols = (np.arange(c0, c1) + 0.5) * factors[1] - 0.5
+        R0, R1 = max(0, int(np.floor(rows[0])) - halo[0]), min(in_shape[0], int(np.floor(rows[-1])) + 1 + halo[0])
+        C0, C1 = max(0, int(np.floor(cols[0])) - halo[1]), min(in_shape[1], int(np.floor(cols[-1])) + 1 + halo[1])
+        gray = skimage.util.img_as_float(to_gray(img[R0:R1, C0:C1]))
+        if anti_aliasing:
+            gray = scipy.ndimage.gaussian_filter(gray, sigma, cval=0, mode="mirror")
+        coords = np.meshgrid(rows - R0, cols - C0, indexing="ij")
+        resized = scipy.ndimage.map_coordinates(gray, coords, order=1, mode="mirror")
+        out[r0:r1, c0:c1] = skimage.util.img_as_ubyte(np.clip(resized, lo, hi))
+    return out
+
+def lbp_window(window: np.ndarray, origin: tuple[int, int], shape: tuple[int, int]) -> np.ndarray:
+    """
+        Default LBP codes (as float64, like skimage) of a window at origin (row, column) of a larger image of the given shape,
+        computed exactly like skimage's compiled loop: the P circle points (offsets rounded to 5 decimals) are sampled at the
+        absolute coordinates of each pixel with bilinear interpolation, and zeros outside the image.
+        Absolute coordinates matter: they fix the rounding of the interpolation weights, so windows give the same codes as
+        the whole image (skimage on a crop may not, on flat regions). Pixels within LBP_HALO of the window edges are only
+        exact where the window touches the image border.
+    """
+    img = window.astype(np.float64)
+    h, w = window.shape
+    p = np.arange(config.P, dtype=np.float64)
+    offsets = np.round(np.vstack([-config.R * np.sin(2 * np.pi * p / config.P), config.R * np.cos(2 * np.pi * p / config.P)]).T, 5)
+    rows = np.arange(h, dtype=np.float64)[:, None] + origin[0]
+    cols = np.arange(w, dtype=np.float64)[None, :] + origin[1]
+
+    def pixel(r: np.ndarray, c: np.ndarray) -> np.ndarray:
+        inside = (r >= 0) & (r < shape[0]) & (c >= 0) & (c < shape[1])
+        local_r = np.clip(r - origin[0], 0, h - 1).astype(np.intp)
+        local_c = np.clip(c - origin[1], 0, w - 1).astype(np.intp)
+        return np.where(inside, img[local_r, local_c], 0.0)
+
+    codes = np.zeros((h, w), dtype=np.float64)
+    for i, (dr, dc) in enumerate(offsets):
+        r, c = rows + dr, cols + dc
+        min_r, min_c, max_r, max_c = np.floor(r), np.floor(c), np.ceil(r), np.ceil(c)
+        wr, wc = r - min_r, c - min_c
+        top = (1 - wc) * pixel(min_r, min_c) + wc * pixel(min_r, max_c)
+        bottom = (1 - wc) * pixel(max_r, min_c) + wc * pixel(max_r, max_c)
+        codes += ((1 - wr) * top + wr * bottom - img >= 0) * 2.0**i
+    return codes
+
+def lbp(gray: np.ndarray, tile: int|None = None) -> np.ndarray:
+    ## standard LBP
+    if tile is not None:
+        out = np.empty(gray.shape, dtype=np.uint8)
+        for bounds in tiling.tiles(gray.shape, tile):
+            r0, r1, c0, c1 = bounds
+            R0, R1, C0, C1 = tiling.with_halo(bounds, LBP_HALO, gray.shape)
+            codes = lbp_window(gray[R0:R1, C0:C1], (R0, C0), gray.shape)
+            out[r0:r1, c0:c1] = codes[r0 - R0:r1 - R0, c0 - C0:c1 - C0].astype(np.uint8)
+        return out
+    ## LBP generates float64 image in range [0.0, 255.0]
+    return skimage.feature.local_binary_pattern(
+        gray,
+        P = config.P,
+        R = config.R,
+        method="default"
+    ).astype(np.uint8)
+
+def glcm(gray: np.ndarray, tile: int|None = None) -> np.ndarray:
+    ## GLCM matrix
+    ## return type: np.uint32
+    ## we do rescaling (mapping [0, max count] to [0, 2**32 - 1])
+    ## then normalize to float interval [0, 1] and finally quantize to uint8
+    ## shape (MAXL + 1, MAXL + 1, D, A)
+    if tile is not None:
+        counts = graycomatrix_tiled(gray, config.DISTANCES, config.ANGLES, tile=tile)
+    else:
+        counts = skimage.feature.graycomatrix(
+            image=gray,
+            distances=config.DISTANCES,
+            angles=config.ANGLES
+        )
+    return skimage.util.img_as_ubyte(
+        skimage.util.img_as_float(
+            skimage.exposure.rescale_intensity(counts)
+        )
+    )
+
+def sobel(gray: np.ndarray, tile: int|None = None) -> np.ndarray:
+    ## Sobel filter generates float in [0.0, 1.0]
+    if tile is not None:
+        return tiling.apply_tiled(sobel, gray, SOBEL_HALO, tile)
+    return skimage.util.img_as_ubyte(skimage.filters.sobel(gray))
+
+def haralick(glcm_matrix: np.ndarray, props: list[str] = PROPS) -> dict[str, np.ndarray]:
+    ## Haralick properties of the GLCM exactly as it is stored (i.e. as uint32),
+    ## one value for each (distance, angle) offset, flattened to D * A
+    return {prop: values.reshape(-1) for prop, values in graycoprops(glcm_matrix.astype(np.uint32), props).items()}
+
+def lbp_histogram(lbp_img: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    ## counts and bin edges, same as histograms.py computes from the stored LBP rows (before normalization)
+    hist, bin_edges = histograms.row_histograms(lbp_img.reshape(1, -1), bins=LBP_HIST_BINS)
+    return hist[0], bin_edges[0]
+
+def feature_specs(props: list[str] = PROPS,
+                  save_glcm: bool = False,
+                  *,
+                  save_lbp: bool = True,
+                  lbp_hist: bool = False,
+                  shape: tuple[int, int] = config.SHAPE) -> dict[str, tuple[int, np.dtype]]:
+    """
+        Width (flattened row length) and dtype of each feature row, as stored in the .npy files.
+    """
+    num_offsets = len(config.DISTANCES) * len(config.ANGLES)
+    specs = {}
+    if save_lbp:
+        specs["LBP"] = (int(np.prod(shape)), np.uint8)
+    if lbp_hist:
+        specs["LBP_hist"] = (LBP_HIST_BINS, np.float64)
+        specs["LBP_hist_edges"] = (LBP_HIST_BINS + 1, np.float64)
+    specs["sobel"] = (int(np.prod(shape)), np.uint8)
+    if save_glcm:
+        ## GLCM produces np.uint32 output
+        ## see https://github.com/scikit-image/scikit-image/blob/main/skimage/feature/texture.py
+        ## MAXL + 1 = #{0, ..., MAXL}
+        specs["GLCM"] = ((config.MAXL + 1) * (config.MAXL + 1) * num_offsets, np.uint32)
+    for prop in props:
+        specs[prop] = (num_offsets, np.float64)
+    return specs
+
+def params(props: list[str] = PROPS,
+           save_glcm: bool = False,
+           *,
+           save_lbp: bool = True,
+           lbp_hist: bool = False,
+           shape: tuple[int, int] = config.SHAPE) -> dict:
+    """
+        Every parameter that affects the output of extract() (used e.g. as feature cache key).
+    """
+    return {
+        "P": config.P,
+        "R": config.R,
+        "DISTANCES": list(config.DISTANCES),
+        "ANGLES": list(config.ANGLES),
+        "SHAPE": list(shape),
+        "MAXL": config.MAXL,
+        "props": list(props),
+        "save_glcm": save_glcm,
+        "save_lbp": save_lbp,
+        "lbp_hist": lbp_hist,
+    }
+
+def extract(img: np.ndarray,
+            props: list[str] = PROPS,
+            save_glcm: bool = False,
+            *,
+            save_lbp: bool = True,
+            lbp_hist: bool = False,
+            shape: tuple[int, int] = config.SHAPE,
+            tile: int|None = None) -> dict[str, np.ndarray]:
+    """
+        Extracts all features from a single (already decoded) image.
+        Returns a dict mapping each name in feature_specs(props, save_glcm, ...) to its flattened row.
+        The dense GLCM is reduced to its Haralick properties right away, and only returned if save_glcm is set.
+        Likewise, with lbp_hist the LBP histogram is computed right away, and the LBP map is only returned if save_lbp is set.
+        With tile, every stage runs tile by tile (same output, bounded memory for large images).
+    """
+    return extract_gray(preprocess(img, shape, tile), props, save_glcm, save_lbp=save_lbp, lbp_hist=lbp_hist, tile=tile)
+
+def extract_gray(gray: np.ndarray,
+                 props: list[str] = PROPS,
+                 save_glcm: bool = False,
+                 *,
+                 save_lbp: bool = True,
+                 lbp_hist: bool = False,
+                 tile: int|None = None) -> dict[str, np.ndarray]:
+    """
+        Same as extract, for an already preprocessed image (see preprocess and preprocessed.py).
+    """
+    ## stages are only timed when profiling (see profiling.py)
+    glcm_matrix = profiling.timed("GLCM", glcm, gray, tile)
+    lbp_img = profiling.timed("LBP", lbp, gray, tile)
+    row = {}
+    if save_lbp:
+        row["LBP"] = lbp_img.reshape(-1)
+    if lbp_hist:
+        row["LBP_hist"], row["LBP_hist_edges"] = profiling.timed("LBP_hist", lbp_histogram, lbp_img)
+    row["sobel"] = profiling.timed("sobel", sobel, gray, tile).reshape(-1)
+    row.update(profiling.timed("haralick", haralick, glcm_matrix, props))
+    if save_glcm:
+        row["GLCM"] = glcm_matrix.reshape(-1)
+    return row
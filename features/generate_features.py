@@ -1,15 +1,22 @@
-import skimage
-import skimage.feature, skimage.filters, skimage.color, skimage.transform, skimage.util
 from dataset import Dataset
 import numpy as np
 from tqdm import tqdm
-import sys, os.path
+import os.path
+import argparse
+import functools
 import config
+import extraction
+import glcm
+import augment
+from writer import FeatureWriter
+from cache import FeatureCache
+from preprocessed import PreprocessedImages
+from profiling import Profiler
 
 """
 LBP format:
     Parameters:
-        H x W images (a total of N)
+        H x W images (a total of N), resized to --shape (config.SHAPE by default)
         P = 8: number of neighbors
         R = 1.0: radius
     Output:
@@ -19,7 +26,7 @@ LBP format:
         
         This is the result of flattening each H x W image.
     
-GLCM format:
+GLCM format (only saved with --save-glcm):
     Parameters:
         N images H x W
         distances: list of D magnitudes of offsets
@@ -38,101 +45,132 @@ SOBEL format:
         2-D array of shape (N, H x W)
         
         this is the result of flattening each filtered H x W image
-"""
-
-if __name__ == '__main__':
-    DS_PATH = sys.argv[1]
-    if (len(sys.argv) > 2):
-        CUTOFF = float(sys.argv[2])
-    else:
-        CUTOFF = float('inf')
-    lbp_path = os.path.basename(DS_PATH) + "_LBP.npy" 
-    glcm_path = os.path.basename(DS_PATH) + "_GLCM.npy"
-    sobel_path = os.path.basename(DS_PATH) + "_sobel.npy"
-    contrast_path = os.path.basename(DS_PATH) + "_contrast.npy"
-
-    transforms = [
-        ## standard LBP
-        ## LBP generates float64 image in range [0.0, 255.0]
-        lambda img: skimage.feature.local_binary_pattern(
-            img,
-            P = config.P,
-            R = config.R,
-            method="default"
-        ).astype(np.uint8),
-
-        ## GLCM matrix
-        ## return type: np.uint32
-        ## we do rescaling (mapping [0, (maxL + 1)**2] to [0, 2**32 - 1])
-        ## then normalize to float interval [0, 1]
-        ## horizontal and diagonal offset 
-        lambda img: 
-        skimage.util.img_as_float(
-            skimage.exposure.rescale_intensity(
-            skimage.feature.graycomatrix(
-                image=img,
-                distances=config.DISTANCES,
-                angles=config.ANGLES
-                )
-            )
-        ),
-       
-        ## Sobel filter
-        ## return type: float in [0.0, 1.0]
-        skimage.filters.sobel
-    ]
-
-    ds: Dataset = Dataset(DS_PATH, config.IGNORE_DIRS)
-
-    LBP_features = np.zeros([min(len(ds), CUTOFF), np.prod(config.SHAPE)], dtype=np.uint8)
-
-    ## GLCM produces np.uint32 output
-    ## see https://github.com/scikit-image/scikit-image/blob/main/skimage/feature/texture.py
-    ## MAXL + 1 = #{0, ..., MAXL}
-    GLCM_features = np.zeros([min(len(ds), CUTOFF), (config.MAXL + 1) * (config.MAXL + 1) * len(config.DISTANCES) * len(config.ANGLES)], dtype=np.uint32)
-
-    sobel_features = np.zeros([min(len(ds), CUTOFF), np.prod(config.SHAPE)], dtype=np.uint8)
-    contrast_features = np.zeros([min(len(ds), CUTOFF), len(config.DISTANCES) * len(config.ANGLES)])
-
-    for i, T in enumerate(transforms): 
-        T_preprocessed = [
-            lambda a : skimage.color.rgb2gray(a) if (len(a.shape) == 3 and a.shape[-1] == 3) else a, ## map to grayscale (if not in grayscale)
-            lambda a: skimage.transform.resize(a, config.SHAPE), ## resize to SHAPE
-            skimage.util.img_as_ubyte, ## rgb2gray uses float coeficients, so the resulting image is float. Also, skimage "resize" uses interpolation (producing float image)
-            T, ## apply transform
-            skimage.util.img_as_ubyte, ## sobel filter transforms image to float
-            lambda a: np.reshape(a, [np.prod(a.shape)]), ## flatten (total)
-        ]
-        for j, res in enumerate(tqdm(ds.lazy_apply(T_preprocessed, as_float=False), total=min(len(ds), CUTOFF))):
-            if (j >= CUTOFF): break
-            if (i == 0):
-                LBP_features[j, :] = res
-            elif (i == 1):
-                GLCM_features[j, :] = res
-            elif (i == 2):
-                sobel_features[j, :] = res
-
-    for j in tqdm(range(min(len(ds), CUTOFF))):
-        contrast_row_j = skimage.feature.graycoprops(GLCM_features[j, :].reshape(config.MAXL + 1, config.MAXL + 1, len(config.DISTANCES), len(config.ANGLES)), prop="contrast")
-        contrast_features[j, :] = contrast_row_j.reshape(len(config.DISTANCES) * len(config.ANGLES))
 
+LBP histogram format (only saved with --lbp-hist):
+    Parameters:
+        N LBP maps (computed as above, but not necessarily saved: see --no-lbp)
+    Output:
+        2-D arrays of shape (N, 256) (counts) and (N, 257) (bin edges),
+        the same rows histograms.py computes from the LBP matrix (before normalization)
 
-    print("Extracted features")
-    print(f"LBP: {LBP_features.shape}")
-    print(f"GLCM: {GLCM_features.shape}")
-    print(f"Sobel: {sobel_features.shape}")
-    print(f"Contrast matrix: {contrast_features.shape}")
+GLCM properties format (contrast, and those requested with --props, e.g. energy, homogeneity, correlation, ASM):
+    Parameters:
+        N GLCMs (computed as above), each one reduced right after it is built (see glcm.graycoprops)
+    Output:
+        one file per property, 2-D array of shape (N, D x A)
 
-    print(f"Saving LBP in {lbp_path}")
-    np.save(lbp_path, LBP_features)
+Unless --no-preprocessed is given (or augmentations are requested, which need the decoded RGB images),
+features are computed from the preprocessed-image tensor "<dataset>.preprocessed.npy" (see preprocessed.py),
+which is built on the first run (for the first `cutoff` images) and only updated for new or changed images afterwards.
+If it can't be written (e.g. read-only dataset location, see --preprocessed-dir), the source images are decoded instead.
 
-    print(f"Saving GLCM in {glcm_path}")
-    np.save(glcm_path, GLCM_features)
+The parameters of the extraction (shape, decode size, preprocessed tensor used, ...) are saved in
+"<dataset>[_<augmentation>]_params.json" (see writer.read_params).
+"""
 
-    print(f"Saving Sobel-filtered images in {sobel_path}")
-    np.save(sobel_path, sobel_features)
+def init_parser():
+    parser = argparse.ArgumentParser(description="Extract LBP, GLCM, Sobel and contrast features from a dataset")
+    parser.add_argument("dataset_path", type=str)
+    parser.add_argument("cutoff", type=float, nargs="?", default=float('inf'), help="Maximum number of images to process")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (output is identical to the serial run)")
+    parser.add_argument("--props", nargs="+", default=list(extraction.PROPS), choices=glcm.PROPS, help="GLCM (Haralick) properties to save (default: contrast)")
+    parser.add_argument("--shape", type=int, nargs=2, default=list(config.SHAPE), metavar=("H", "W"),
+                        help="Resolution the images are resized to before extraction (e.g. the input size of the model)")
+    parser.add_argument("--save-glcm", action="store_true", help="Also save the dense GLCM matrices (multi-GB for large datasets)")
+    parser.add_argument("--lbp-hist", action="store_true",
+                        help="Also save the histogram of each LBP map (<dataset>_LBP_hist.npy and <dataset>_LBP_hist_edges.npy, see histograms.py)")
+    parser.add_argument("--no-lbp", action="store_true", help="Don't save the dense LBP maps (e.g. with --lbp-hist)")
+    parser.add_argument("--cache", type=str, default=None, help="Directory of the per-image feature cache (reused across runs and datasets)")
+    parser.add_argument("--cache-size", type=float, default=20.0, help="Maximum size of the feature cache, in GB")
+    parser.add_argument("--augment", nargs="+", default=[augment.ORIGINAL], choices=augment.names(),
+                        help="Augmentations (from spatial_transforms/gen_dataset.py) applied in memory to the original images; "
+                             "features of each one are saved as <dataset>_<augmentation>_<feature>.npy")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="Process each image in tiles of TILE x TILE pixels (same features, memory bounded by the tile size: for large images)")
+    parser.add_argument("--reduced-decode", action="store_true",
+                        help="Decode JPEGs at 1/2, 1/4 or 1/8 scale when the result is still at least --shape (much faster for large images; "
+                             "features differ slightly from a full-resolution decode)")
+    parser.add_argument("--no-preprocessed", action="store_true",
+                        help="Decode and preprocess the source images instead of reading the preprocessed-image tensor")
+    parser.add_argument("--preprocessed-dir", type=str, default=None,
+                        help="Directory of the preprocessed-image tensor (default: next to the dataset; without write access there, "
+                             "the source images are decoded instead)")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Save a JSON report of the time spent in each stage (decoding, each transform, ...) to this file")
+    parser.add_argument("--profile-interval", type=float, default=None,
+                        help="Also update the profile report every this many seconds while running")
+    return parser
 
-    print(f"Saving contrast matrix in {contrast_path}")
-    np.save(contrast_path, contrast_features)
+if __name__ == '__main__':
+    parser = init_parser()
+    args = parser.parse_args()
+    DS_PATH = args.dataset_path
+    CUTOFF = args.cutoff
+    if args.reduced_decode and args.augment != [augment.ORIGINAL]:
+        ## augmentations (e.g. the Gaussian sigma) are defined on full-resolution images
+        parser.error("--reduced-decode can't be combined with --augment")
+
+    ds: Dataset = Dataset(DS_PATH, config.IGNORE_DIRS, decode_size=tuple(args.shape) if args.reduced_decode else None)
+    n = int(min(len(ds), CUTOFF))
+
+    ## rows are streamed into memory-mapped .npy files ("<dataset>[_<augmentation>]_<feature>.npy")
+    dataset_name = os.path.basename(os.path.normpath(DS_PATH))
+    feature_opts = {"save_lbp": not args.no_lbp, "lbp_hist": args.lbp_hist}
+    specs = extraction.feature_specs(args.props, args.save_glcm, shape=tuple(args.shape), **feature_opts)
+
+    use_preprocessed = not args.no_preprocessed and args.augment == [augment.ORIGINAL]
+    cache = None
+    if args.cache is not None:
+        ## cached rows are keyed by image contents + every parameter that affects extraction
+        cache_params = {**extraction.params(args.props, args.save_glcm, shape=tuple(args.shape), **feature_opts), **augment.params(args.augment),
+                        "decode_size": list(ds.decode_size) if ds.decode_size is not None else None}
+        cache = FeatureCache(args.cache, cache_params, max_bytes=int(args.cache_size * 2**30))
+
+    profiler = Profiler(args.profile, args.profile_interval) if args.profile is not None else None
+
+    if use_preprocessed:
+        ## images are read already preprocessed from the memory-mapped tensor (built/updated here if needed, first n rows only)
+        preprocessed = PreprocessedImages(ds, shape=tuple(args.shape), tile=args.tile, directory=args.preprocessed_dir)
+        try:
+            if profiler is not None:
+                profiler.timed("build_preprocessed", preprocessed.images, workers=args.workers, n=n)
+            else:
+                preprocessed.images(workers=args.workers, n=n)
+        except OSError as e:
+            ## e.g. dataset on a read-only mount (see --preprocessed-dir): same features from the source images
+            print(f"Can't write the preprocessed-image tensor ({e}), decoding the source images instead")
+            use_preprocessed = False
+
+    ## recorded with the features, so that readers (e.g. plot_random.py) see the images they were computed from
+    feature_params = {**extraction.params(args.props, args.save_glcm, shape=tuple(args.shape), **feature_opts),
+                      "decode_size": list(ds.decode_size) if ds.decode_size is not None else None,
+                      "preprocessed_path": os.path.abspath(preprocessed.path) if use_preprocessed else None}
+    writers = {name: FeatureWriter(augment.output_prefix(dataset_name, name), n, specs, params=feature_params) for name in args.augment}
+
+    if use_preprocessed:
+        extract = functools.partial(extraction.extract_gray, props=args.props, save_glcm=args.save_glcm, tile=args.tile, **feature_opts)
+        results = ({augment.ORIGINAL: res} for res in preprocessed.lazy_apply([extract], n=n, workers=args.workers, cache=cache, profiler=profiler))
+    else:
+        ## single pass: each image is decoded and preprocessed once (see extraction.py),
+        ## and each augmentation is applied in memory to the decoded image (see augment.py)
+        extract = augment.AugmentedExtract(args.augment,
+                                           functools.partial(extraction.extract, props=args.props, save_glcm=args.save_glcm,
+                                                             shape=tuple(args.shape), tile=args.tile, **feature_opts),
+                                           tile=args.tile)
+        results = (augment.split(res) for res in ds.lazy_apply([extract], n=n, as_float=False, workers=args.workers, cache=cache, profiler=profiler))
+    for j, res in enumerate(tqdm(results, total=n)):
+        for name, rows in res.items():
+            if profiler is not None:
+                profiler.timed(f"write:{name}", writers[name].write, j, rows)
+            else:
+                writers[name].write(j, rows)
 
+    print("Extracted features")
+    for writer in writers.values():
+        writer.close()
+    if profiler is not None:
+        profiler.dump()
+        print(f"Saved profile report in {args.profile}")
+    if cache is not None:
+        print(f"Evicted {cache.evict()} entries from feature cache {args.cache}")
     print("Done!")
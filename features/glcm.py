@@ -0,0 +1,238 @@
+import numpy as np
+import skimage.feature
+import sys
+import config
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+import tiling
+
+"""
+Gray-level co-occurrence matrices (GLCM) and their Haralick properties.
+
+skimage.feature.graycomatrix handles a single image per call and counts every (distance, angle) offset.
+graycomatrix processes a whole stack of images (N, H, W) at once, and counts opposite offsets (e.g. angles 0
+and pi in config.ANGLES) only once, since they produce transposed matrices.
+
+Two counting methods are available for the remaining offsets:
+    "bincount": every pair (reference pixel i, neighbour pixel j) is encoded as a flat index i * L + j in one
+                vectorized pass and all pairs are counted with a single np.bincount
+    "skimage":  skimage's compiled per-pixel loop, called once per distinct offset
+Both give exactly the same result as calling skimage.feature.graycomatrix on each image (see check()).
+np.bincount costs a roughly constant ~2 ms per offset on a 768x1024 image, about twice skimage's loop on smooth
+(real) images, so "skimage" is the default, and extraction.glcm still calls skimage directly (the benchmarks
+glcm.* in benchmarks/bench.py compare the three). The bincount counting is only used where memory matters:
+graycomatrix_tiled counts a large image tile by tile.
+graycoprops computes several properties of a stack of GLCMs at once, normalizing each GLCM only once.
+"""
+
+def _round(x: float) -> int:
+    ## graycomatrix rounds half away from zero, as sign(x) * floor(|x| + 0.5) in floating point
+    ## (not Python's round, which is half to even; note 0.49999999999999994 is rounded to 1)
+    return int(np.copysign(np.floor(abs(x) + 0.5), x))
+
+def offsets(distances: list[float], angles: list[float]) -> list[tuple[int, int, int, int]]:
+    """
+        (d_idx, a_idx, row offset, column offset) for every (distance, angle) pair,
+        rounded exactly as graycomatrix does.
+    """
+    return [
+        (d_idx, a_idx, _round(np.sin(angle) * distance), _round(np.cos(angle) * distance))
+        for a_idx, angle in enumerate(np.asarray(angles, dtype=np.float64))
+        for d_idx, distance in enumerate(np.asarray(distances, dtype=np.float64))
+    ]
+
+def _count_pairs(img: np.ndarray, dr: int, dc: int, levels: int, buf: np.ndarray) -> np.ndarray:
+    """
+        Co-occurrence counts (levels, levels) of one image for one offset.
+        buf is a scratch array (at least as large as the image) holding the pair indices,
+        np.uint16 when levels <= 256 (so that i * L + j fits), np.intp otherwise.
+    """
+    rows, cols = img.shape
+    r0, r1 = max(0, -dr), min(rows, rows - dr)
+    c0, c1 = max(0, -dc), min(cols, cols - dc)
+    if (r0 >= r1 or c0 >= c1):
+        return np.zeros((levels, levels), dtype=np.intp)
+    idx = buf[:(r1 - r0) * (c1 - c0)].reshape(r1 - r0, c1 - c0)
+    np.multiply(img[r0:r1, c0:c1], levels, out=idx, dtype=idx.dtype)
+    np.add(idx, img[r0 + dr:r1 + dr, c0 + dc:c1 + dc], out=idx, dtype=idx.dtype)
+    return np.bincount(idx.ravel(), minlength=levels * levels).reshape(levels, levels)
+
+def graycomatrix(images: np.ndarray,
+                 distances: list[float] = config.DISTANCES,
+                 angles: list[float] = config.ANGLES,
+                 levels: int = None,
+                 symmetric: bool = False,
+                 normed: bool = False,
+                 *,
+                 method: str = "skimage") -> np.ndarray:
+    """
+        Batched equivalent of skimage.feature.graycomatrix.
+        images: (N, H, W) stack of unsigned integer images (a single (H, W) image is also accepted)
+        method: "skimage" or "bincount" (see module docstring)
+        Returns array of shape (N, levels, levels, D, A) (np.uint32, or np.float64 if normed)
+    """
+    if method not in ("skimage", "bincount"):
+        raise ValueError(f"Invalid method {method}")
+    images = np.asarray(images)
+    if (images.ndim == 2):
+        return graycomatrix(images[np.newaxis], distances, angles, levels, symmetric, normed, method=method)[0]
+    if (images.ndim != 3):
+        raise ValueError("Expected a (N, H, W) stack of images")
+    if np.issubdtype(images.dtype, np.floating):
+        raise ValueError("Float images are not supported by graycomatrix. Convert the image to an unsigned integer type.")
+    if (images.dtype not in (np.uint8, np.int8) and levels is None):
+        raise ValueError("The levels argument is required for data types other than uint8.")
+    if np.issubdtype(images.dtype, np.signedinteger) and np.any(images < 0):
+        raise ValueError("Negative-valued images are not supported.")
+    if levels is None:
+        levels = 256
+    if (images.size > 0 and images.max() >= levels):
+        raise ValueError("The maximum grayscale value in the image should be smaller than the number of levels.")
+
+    N, rows, cols = images.shape
+    P = np.zeros((N, levels, levels, len(distances), len(angles)), dtype=np.uint32)
+    if (method == "bincount"):
+        buf = np.empty(rows * cols, dtype=np.uint16 if levels <= 256 else np.intp)
+
+    ## offsets (dr, dc) and (-dr, -dc) give transposed matrices: count each pair of offsets once
+    counted = {}
+    plan = []
+    for d_idx, a_idx, dr, dc in offsets(distances, angles):
+        if (dr, dc) in counted:
+            plan.append((d_idx, a_idx, dr, dc, counted[(dr, dc)], False))
+        elif (-dr, -dc) in counted:
+            plan.append((d_idx, a_idx, dr, dc, counted[(-dr, -dc)], True))
+        else:
+            counted[(dr, dc)] = (d_idx, a_idx)
+            plan.append((d_idx, a_idx, dr, dc, None, False))
+
+    ## with "skimage", all the angles that still need counting go in a single call per image
+    needed_angles = sorted({a_idx for _, a_idx, _, _, source, _ in plan if source is None})
+    needed_angle_values = [angles[a_idx] for a_idx in needed_angles]
+
+    for n in range(N):
+        img = images[n]
+        if (method == "skimage"):
+            Q = skimage.feature.graycomatrix(img, distances, needed_angle_values, levels=levels)
+        for d_idx, a_idx, dr, dc, source, transpose in plan:
+            if source is None and method == "bincount":
+                P[n, :, :, d_idx, a_idx] = _count_pairs(img, dr, dc, levels, buf)
+            elif source is None:
+                P[n, :, :, d_idx, a_idx] = Q[:, :, d_idx, needed_angles.index(a_idx)]
+            else:
+                src = P[n, :, :, source[0], source[1]]
+                P[n, :, :, d_idx, a_idx] = src.T if transpose else src
+
+    # make each GLCM symmetric
+    if symmetric:
+        P = P + np.transpose(P, (0, 2, 1, 3, 4))
+
+    # normalize each GLCM
+    if normed:
+        P = P.astype(np.float64)
+        glcm_sums = np.sum(P, axis=(1, 2), keepdims=True)
+        glcm_sums[glcm_sums == 0] = 1
+        P /= glcm_sums
+
+    return P
+
+def graycomatrix_tiled(img: np.ndarray,
+                       distances: list[float] = config.DISTANCES,
+                       angles: list[float] = config.ANGLES,
+                       levels: int = 256,
+                       tile: int = tiling.TILE) -> np.ndarray:
+    """
+        skimage.feature.graycomatrix(img, distances, angles, levels) of a single uint8 image, counted tile by tile
+        (each pair is counted in the tile of its reference pixel), so the pair indices only cover one tile at a time.
+        Returns array of shape (levels, levels, D, A) (np.uint32)
+    """
+    rows, cols = img.shape
+    P = np.zeros((levels, levels, len(distances), len(angles)), dtype=np.uint32)
+    for d_idx, a_idx, dr, dc in offsets(distances, angles):
+        for r0, r1, c0, c1 in tiling.tiles(img.shape, tile):
+            ## reference pixels of the tile whose neighbour is inside the image
+            ra, rb = max(r0, -dr), min(r1, rows - dr)
+            ca, cb = max(c0, -dc), min(c1, cols - dc)
+            if (ra >= rb or ca >= cb):
+                continue
+            idx = img[ra:rb, ca:cb].astype(np.intp) * levels + img[ra + dr:rb + dr, ca + dc:cb + dc]
+            P[:, :, d_idx, a_idx] += np.bincount(idx.ravel(), minlength=levels * levels).reshape(levels, levels).astype(np.uint32)
+    return P
+
+PROPS = ("contrast", "dissimilarity", "homogeneity", "energy", "ASM", "correlation")
+
+def graycoprops(P: np.ndarray, props: list[str] = ("contrast",)) -> dict[str, np.ndarray]:
+    """
+        Batched equivalent of skimage.feature.graycoprops, computing several properties at once.
+        P: (N, L, L, D, A) stack of GLCMs (a single (L, L, D, A) GLCM is also accepted)
+        Returns a dict mapping each property to an array of shape (N, D, A) (or (D, A) for a single GLCM).
+        Each GLCM is normalized once and shared by all properties; the reductions follow graycoprops exactly.
+    """
+    P = np.asarray(P)
+    if (P.ndim == 4):
+        return {prop: res[0] for prop, res in graycoprops(P[np.newaxis], props).items()}
+    if (P.ndim != 5):
+        raise ValueError("Expected a (N, L, L, D, A) stack of GLCMs")
+    for prop in props:
+        if prop not in PROPS:
+            raise ValueError(f"{prop} is an invalid property")
+    num_level = P.shape[1]
+    if (num_level != P.shape[2]):
+        raise ValueError("num_level and num_level2 must be equal.")
+
+    # normalize each GLCM
+    P = P.astype(np.float64)
+    glcm_sums = np.sum(P, axis=(1, 2), keepdims=True)
+    glcm_sums[glcm_sums == 0] = 1
+    P /= glcm_sums
+
+    I = np.arange(num_level).reshape((1, num_level, 1, 1, 1))
+    J = np.arange(num_level).reshape((1, 1, num_level, 1, 1))
+    results = {}
+    for prop in props:
+        if prop == "contrast":
+            results[prop] = np.sum(P * (I - J) ** 2, axis=(1, 2))
+        elif prop == "dissimilarity":
+            results[prop] = np.sum(P * np.abs(I - J), axis=(1, 2))
+        elif prop == "homogeneity":
+            results[prop] = np.sum(P * (1.0 / (1.0 + (I - J) ** 2)), axis=(1, 2))
+        elif prop in ("ASM", "energy"):
+            if "ASM" not in results:
+                results["ASM"] = np.sum(P**2, axis=(1, 2))
+            if prop == "energy":
+                results[prop] = np.sqrt(results["ASM"])
+        elif prop == "correlation":
+            diff_i = I - np.sum(I * P, axis=(1, 2), keepdims=True)
+            diff_j = J - np.sum(J * P, axis=(1, 2), keepdims=True)
+            std_i = np.sqrt(np.sum(P * diff_i ** 2, axis=(1, 2)))
+            std_j = np.sqrt(np.sum(P * diff_j ** 2, axis=(1, 2)))
+            cov = np.sum(P * (diff_i * diff_j), axis=(1, 2))
+            # handle the special case of standard deviations near zero
+            mask_0 = (std_i < 1e-15) | (std_j < 1e-15)
+            corr = np.ones_like(cov)
+            corr[~mask_0] = cov[~mask_0] / (std_i[~mask_0] * std_j[~mask_0])
+            results[prop] = corr
+    return {prop: results[prop] for prop in props}
+
+def check(n: int = 4, shape: tuple[int, int] = (300, 400), seed: int = 0):
+    """
+        Checks graycomatrix (both methods), graycomatrix_tiled and graycoprops against skimage on n smooth,
+        noisy uint8 images (similar to real grayscale glomerulus images).
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    images = np.stack([
+        np.clip(128 + 60 * np.sin(x / 17.0 + k) * np.cos(y / 23.0) + rng.normal(0, 10, shape), 0, config.MAXL).astype(np.uint8)
+        for k in range(n)
+    ])
+    expected = np.stack([skimage.feature.graycomatrix(img, config.DISTANCES, config.ANGLES) for img in images])
+    for method in ("skimage", "bincount"):
+        assert np.array_equal(graycomatrix(images, method=method), expected), f"batched GLCM ({method}) does not match skimage"
+    assert np.array_equal(graycomatrix_tiled(images[0], tile=100), expected[0]), "tiled GLCM does not match skimage"
+    props = graycoprops(expected, PROPS)
+    for prop in PROPS:
+        assert np.allclose(props[prop], np.stack([skimage.feature.graycoprops(P, prop) for P in expected])), f"{prop} does not match skimage"
+    print("graycomatrix, graycomatrix_tiled and graycoprops match skimage")
+
+if __name__ == "__main__":
+    check()
@@ -4,33 +4,113 @@ import argparse
 from tqdm import tqdm
 import config
 
+## rows of each chunk streamed from the memory-mapped LBP matrix are bounded by this many bytes of temporaries
+CHUNK_BYTES = 2**28
+
+def _level_bins(lo, hi, bins: int, dtype) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Bin index of each level lo..hi and the bin edges, exactly as np.histogram(row, bins) computes them
+        for a row of the given integer dtype whose minimum is lo and maximum is hi
+        (the edges only depend on the minimum and maximum, and the bin of each value only on the value).
+    """
+    levels = np.arange(lo, hi + 1).astype(dtype)
+    levels_per_bin, edges = np.histogram(levels, bins=bins)
+    return np.repeat(np.arange(bins), levels_per_bin), edges
+
+def level_counts(rows: np.ndarray, levels: int = 256) -> np.ndarray:
+    """
+        Count of each level 0..levels-1 in every row of a 2-D integer array (values in [0, levels)), as int64 (n, levels),
+        with a single bincount (row j offset by levels * j).
+    """
+    n = rows.shape[0]
+    return np.bincount((rows + (np.arange(n, dtype=np.int64) * levels)[:, None]).ravel(), minlength=n * levels).reshape(n, levels)
+
+def row_histograms(rows: np.ndarray, bins: int = 256) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Histograms of every row of a 2-D uint8 array, identical to np.histogram(rows[j, :], bins=bins) for each j
+        (bins spanning [min, max] of each row): returns counts (n, bins) and bin edges (n, bins + 1), as float64.
+        The value counts of all rows are computed at once (see level_counts),
+        and then grouped into bins once per distinct (min, max) pair.
+    """
+    if rows.dtype != np.uint8:
+        raise ValueError(f"Expected an uint8 matrix, got {rows.dtype}")
+    n = rows.shape[0]
+    levels = 256
+    counts = level_counts(rows, levels)
+    present = counts > 0
+    lo = present.argmax(axis=1)
+    hi = levels - 1 - present[:, ::-1].argmax(axis=1)
+
+    hist = np.zeros((n, bins), dtype=np.float64)
+    bin_edges = np.zeros((n, bins + 1), dtype=np.float64)
+    for (l, h) in set(zip(lo.tolist(), hi.tolist())):
+        group = np.flatnonzero((lo == l) & (hi == h))
+        level_bins, edges = _level_bins(l, h, bins, rows.dtype)
+        ## levels are sorted, so each bin holds a contiguous run of levels
+        used_bins, starts = np.unique(level_bins, return_index=True)
+        hist[np.ix_(group, used_bins)] = np.add.reduceat(counts[group, l:h + 1], starts, axis=1)
+        bin_edges[group, :] = edges
+    return hist, bin_edges
+
+def lbp_histograms(lbp_filepath: str,
+                   bins: int = 256,
+                   normalize: bool = True,
+                   chunk_bytes: int = CHUNK_BYTES) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Histograms (see row_histograms) of every row of an (N, H x W) LBP .npy file, streamed in chunks of rows
+        from a memory map, so the LBP matrix never needs to fit in memory.
+        With normalize, counts are divided by the number of pixels of each row (see normalize_counts).
+    """
+    lbp_matrix = np.load(lbp_filepath, mmap_mode="r")
+    n, width = lbp_matrix.shape
+    rows_per_chunk = max(1, chunk_bytes // (8 * max(width, 1))) ## row indices are offset as int64
+    h = np.zeros((n, bins), dtype=np.float64)
+    # b bins ==> b + 1 edges
+    bin_edges = np.zeros((n, bins + 1), dtype=np.float64)
+    for start in tqdm(range(0, n, rows_per_chunk)):
+        stop = min(n, start + rows_per_chunk)
+        h[start:stop], bin_edges[start:stop] = row_histograms(np.asarray(lbp_matrix[start:stop]), bins=bins)
+    if normalize:
+        h = normalize_counts(h)
+    return h, bin_edges
+
+def normalize_counts(h: np.ndarray) -> np.ndarray:
+    ## frequencies (each row sums to 1)
+    return h / h.sum(axis=1, keepdims=True)
+
+def save_lbp_histograms(hist: np.ndarray, bin_edges: np.ndarray, hist_file: str):
+    print(f"Final histogram matrix: shape {hist.shape}")
+    print(f"Final bin edges matrix: shape {bin_edges.shape}")
+    np.savez_compressed(hist_file, lbp_histograms=hist, lbp_bin_edges=bin_edges)
+
 def gen_lbp_histograms(lbp_files: list[str],
                        hist_file: str,
                        bins = 256,
-                       normalize = True):
+                       normalize = True,
+                       chunk_bytes: int = CHUNK_BYTES):
+    """
+        Saves the histograms of the rows of every file in lbp_files (concatenated) to hist_file.
+        Files may be dense LBP matrices ("<prefix>_LBP.npy") or histograms already computed during extraction
+        ("<prefix>_LBP_hist.npy", next to "<prefix>_LBP_hist_edges.npy", see generate_features.py --lbp-hist).
+    """
     hist_matrices = []
     bin_edges_matrices = []
     for i, lbp_filepath in enumerate(lbp_files):
         print(f"Working on lbp file {lbp_filepath}")
-        lbp_matrix = np.load(lbp_filepath)
-        h = np.zeros((lbp_matrix.shape[0], bins), dtype=np.float64)
-        # b bins ==> b + 1 edges
-        bin_edges = np.zeros((lbp_matrix.shape[0], bins + 1), dtype=np.float64)
-        for j in tqdm(range(lbp_matrix.shape[0])):
-            h[j, :], bin_edges_j = np.histogram(lbp_matrix[j, :], bins=bins)
+        if lbp_filepath.endswith("_LBP_hist.npy"):
+            h = np.load(lbp_filepath)
+            bin_edges = np.load(lbp_filepath.replace("_LBP_hist.npy", "_LBP_hist_edges.npy"))
+            if h.shape[1] != bins:
+                raise ValueError(f"{lbp_filepath} has {h.shape[1]} bins, expected {bins}")
             if normalize:
-                bin_edges[j, :] = bin_edges_j.astype(np.float64) / np.float64(bin_edges_j.max())
-            else:
-                bin_edges[j, :] = bin_edges_j.astype(np.float64) 
+                h = normalize_counts(h)
+        else:
+            h, bin_edges = lbp_histograms(lbp_filepath, bins=bins, normalize=normalize, chunk_bytes=chunk_bytes)
         hist_matrices.append(h)
         bin_edges_matrices.append(bin_edges)
 
-    print("Saving final histograms and respective bin_centers")
-    final_hist_mat = np.concatenate(hist_matrices)
-    final_bin_edges_matrix = np.concatenate(bin_edges_matrices)
-    print(f"Final histogram matrix: shape {final_hist_mat.shape}")
-    print(f"Final bin centers matrix: shape {final_bin_edges_matrix.shape}")
-    np.savez_compressed(hist_file, lbp_histograms=final_hist_mat, lbp_bin_edges=final_bin_edges_matrix)
+    print("Saving final histograms and respective bin edges")
+    save_lbp_histograms(np.concatenate(hist_matrices), np.concatenate(bin_edges_matrices), hist_file)
     print("Done")
 
 def gen_global_contrast_histogram(contrast_files: list[str], 
@@ -59,7 +139,7 @@ def main(lbp_files, constrast_files):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-l','--lbp', nargs='+', help='List of LBP .npy files', required=True)
+    parser.add_argument('-l','--lbp', nargs='+', help='List of LBP .npy files (<prefix>_LBP.npy, or <prefix>_LBP_hist.npy from generate_features.py --lbp-hist)', required=True)
     parser.add_argument('-c','--contrast', nargs='+', help='List of constrast .npy files', required=True)
     
     args = parser.parse_args()
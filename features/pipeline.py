@@ -0,0 +1,395 @@
+import os
+import sys
+import ast
+import json
+import time
+import queue
+import shlex
+import hashlib
+import argparse
+import threading
+import subprocess
+import config
+import extraction
+import augment
+import generate_features
+
+"""
+Dependency-aware runner of the whole pipeline (replaces the serial loop of run.sh).
+
+Stages of each dataset <name> found in the datasets folder, as a DAG:
+
+    augment:<name>          gen_dataset.py: <name>_gaussian, <name>_gamma1..3, <name>_laplace, <name>_hist
+    extract:<dataset>       generate_features.py on <name> and on each augmentation (<out>/<dataset>_<feature>.npy)
+    histograms              histograms.py over the LBP and contrast files of every extracted dataset (a single stage,
+                            since it writes LBP_histograms.npz and contrast_histogram.npz in <out>)
+    plots:<dataset>         plot_random.py (with --plots, and the shape and preprocessed tensor of --extract-args;
+                            one at a time, they share the histogram plots in <out>)
+    store:<name>            training/assemble.py: <name> and its augmentations into the store <store>/<name> (with --store)
+
+Stages whose dependencies are done run concurrently, as subprocesses sharing a budget of --workers workers
+(each stage takes up to --stage-workers of them, passed on to the scripts that have --workers). Their output goes
+to <state>/<stage>.log.
+
+A stage is skipped when it is fresh: its stamp (<state>/<stage>.json) records a digest of its command, its inputs
+(size and mtime of every file, walking directories) and the source of the code it runs (its script and every module
+of features/, spatial_transforms/ and training/ the script imports, directly or not, e.g. config.py),
+and the digest still matches and every output exists. A change anywhere upstream (e.g. config.py, or images
+rewritten by augment) changes the digests downstream, so exactly the stages it affects run again.
+
+    python pipeline.py /path/to/datasets Glomerulus --workers 16 --out /path/to/features --store /path/to/stores
+"""
+
+STAMP_VERSION = 1
+FEATURES_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAINING_DIR = os.path.join(FEATURES_DIR, os.pardir, "training")
+
+## gen_dataset.py flag -> suffixes of the datasets it writes
+AUGMENTATIONS = {
+    "gaussian": ["gaussian"],
+    "gamma": ["gamma1", "gamma2", "gamma3"],
+    "laplace": ["laplace"],
+    "hist": ["hist"],
+}
+## features each later stage reads (<out>/<dataset>_<feature>.npy)
+REQUIRED_FEATURES = {
+    "histograms": ["LBP", "contrast"],
+    "plots": ["LBP", "sobel", "contrast"],
+    "store": ["LBP", "sobel", "contrast"], ## assemble.FLAT_FEATURES
+}
+
+## folders of the flat imports of the scripts (their own folder, plus the sys.path.append of the sibling folders)
+CODE_DIRS = [FEATURES_DIR, os.path.normpath(config.SPATIAL_TRANSFORMS_DIR), os.path.normpath(TRAINING_DIR)]
+
+def import_closure(script: str) -> list[str]:
+    """
+        script and every module of CODE_DIRS it imports, directly or through other modules (the source code a stage
+        runs, whose contents are part of its digest). Module names are unique across CODE_DIRS.
+    """
+    seen = set()
+    todo = [os.path.normpath(os.path.abspath(script))]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                for code_dir in CODE_DIRS:
+                    candidate = os.path.join(code_dir, module.split(".")[0] + ".py")
+                    if os.path.isfile(candidate):
+                        todo.append(candidate)
+                        break
+    return sorted(seen)
+
+class Stage:
+    def __init__(self,
+                 name: str,
+                 argv: list[str],
+                 *,
+                 cwd: str,
+                 inputs: list[str],
+                 outputs: list[str],
+                 code: list[str],
+                 deps: list[str] = [],
+                 parallel: bool = False,
+                 lock: str|None = None):
+        """
+            argv: command (without --workers, appended if parallel); inputs/outputs: files or directories;
+            deps: names of the stages that must finish first; stages with the same lock never run at the same time.
+        """
+        self.name = name
+        self.argv = argv
+        self.cwd = cwd
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = code
+        self.deps = deps
+        self.parallel = parallel
+        self.lock = lock
+
+    def command(self, workers: int) -> list[str]:
+        return self.argv + (["--workers", str(workers)] if self.parallel else [])
+
+def fingerprint(path: str) -> list:
+    ## (relative path, size, mtime) of the file, or of every file under the directory; [] if missing
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return [["", st.st_size, st.st_mtime_ns]]
+    entries = []
+    for cwd, subdirs, files in os.walk(path):
+        subdirs.sort()
+        for file in sorted(files):
+            st = os.stat(os.path.join(cwd, file))
+            entries.append([os.path.relpath(os.path.join(cwd, file), path), st.st_size, st.st_mtime_ns])
+    return entries
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def stage_digest(stage: Stage) -> str:
+    state = {
+        "version": STAMP_VERSION,
+        "argv": stage.argv,
+        "inputs": {path: fingerprint(path) for path in stage.inputs},
+        "code": {os.path.basename(path): file_digest(path) for path in stage.code},
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+class Pipeline:
+    def __init__(self, state_dir: str, workers: int, stage_workers: int, *, force: bool = False):
+        if workers < 1 or stage_workers < 1:
+            raise ValueError(f"Worker counts must be at least 1 (workers={workers}, stage_workers={stage_workers})")
+        self.state_dir = state_dir
+        self.workers = workers
+        self.stage_workers = stage_workers
+        self.force = force
+        self.stages: dict[str, Stage] = {}
+
+    def add(self, stage: Stage):
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        self.stages[stage.name] = stage ## insertion order is a topological order
+
+    def _stamp_path(self, stage: Stage) -> str:
+        return os.path.join(self.state_dir, stage.name.replace(":", "_") + ".json")
+
+    def is_fresh(self, stage: Stage, digest: str) -> bool:
+        if self.force or not all(os.path.exists(path) for path in stage.outputs):
+            return False
+        try:
+            with open(self._stamp_path(stage)) as f:
+                return json.load(f)["digest"] == digest
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _execute(self, stage: Stage, workers: int, digest: str, done: queue.Queue):
+        ## runs in a thread: the stage itself is a subprocess
+        start = time.perf_counter()
+        log_path = os.path.join(self.state_dir, stage.name.replace(":", "_") + ".log")
+        try:
+            with open(log_path, "w") as log:
+                ok = subprocess.run(stage.command(workers), cwd=stage.cwd, stdout=log, stderr=subprocess.STDOUT).returncode == 0
+        except OSError as e:
+            print(f"{stage.name}: {e}")
+            ok = False
+        if ok:
+            with open(self._stamp_path(stage), "w") as f:
+                json.dump({"digest": digest, "argv": stage.argv, "seconds": time.perf_counter() - start}, f)
+        done.put((stage.name, ok, time.perf_counter() - start, workers, log_path))
+
+    def run(self, dry_run: bool = False) -> dict[str, str]:
+        """
+            Runs the stages that are not fresh, in dependency order, and returns the status of each stage:
+            "fresh" (skipped), "done", "failed" or "blocked" (a dependency failed); with dry_run, "stale" for the
+            stages that would run (and every stage downstream of them) instead of running them.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        status = {}
+        running = {} ## name -> workers
+        done = queue.Queue()
+        while True:
+            for name, stage in self.stages.items():
+                if name in status or name in running:
+                    continue
+                dep_status = [status.get(dep) for dep in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    status[name] = "blocked"
+                    print(f"[blocked] {name}")
+                    continue
+                if dry_run and "stale" in dep_status:
+                    status[name] = "stale"
+                    print(f"[stale]   {name}")
+                    continue
+                if not all(s in ("fresh", "done") for s in dep_status):
+                    continue
+                free = self.workers - sum(running.values())
+                if not dry_run and (free < 1 or any(self.stages[r].lock is not None and self.stages[r].lock == stage.lock for r in running)):
+                    continue
+                digest = stage_digest(stage)
+                if self.is_fresh(stage, digest):
+                    status[name] = "fresh"
+                    print(f"[fresh]   {name}")
+                elif dry_run:
+                    status[name] = "stale"
+                    print(f"[stale]   {name}: {shlex.join(stage.command(min(self.stage_workers, self.workers)))}")
+                else:
+                    workers = min(self.stage_workers, free) if stage.parallel else 1
+                    running[name] = workers
+                    print(f"[start]   {name} ({workers} worker{'s' if workers > 1 else ''})")
+                    threading.Thread(target=self._execute, args=(stage, workers, digest, done), daemon=True).start()
+            if len(status) == len(self.stages):
+                break
+            if not running:
+                continue ## stages resolved in this pass (fresh, blocked) may unblock others
+            name, ok, seconds, workers, log_path = done.get()
+            del running[name]
+            status[name] = "done" if ok else "failed"
+            if ok:
+                print(f"[done]    {name} ({seconds:.1f} s)")
+            else:
+                print(f"[failed]  {name} (see {log_path})")
+        return status
+
+def parse_extract_args(extract_args: list[str]) -> argparse.Namespace:
+    """
+        extract_args parsed as generate_features.py arguments. Raises ValueError for arguments the pipeline can't run with.
+    """
+    parsed = generate_features.init_parser().parse_args(["dataset", *extract_args])
+    if parsed.augment != [augment.ORIGINAL]:
+        raise ValueError("--augment can't be given in --extract-args (augmentations are the augment stage, see --augment)")
+    return parsed
+
+def extract_features(parsed: argparse.Namespace) -> list[str]:
+    ## features generate_features.py saves with these arguments (one <dataset>_<feature>.npy file each)
+    return list(extraction.feature_specs(parsed.props, parsed.save_glcm, save_lbp=not parsed.no_lbp, lbp_hist=parsed.lbp_hist,
+                                         shape=tuple(parsed.shape)))
+
+def plot_args(parsed: argparse.Namespace) -> list[str]:
+    ## plot_random.py arguments for features extracted with these arguments (same shape, decoding and preprocessed tensor)
+    argv = ["--shape", *(str(side) for side in parsed.shape)]
+    if parsed.reduced_decode:
+        argv.append("--reduced-decode")
+    if parsed.no_preprocessed:
+        argv.append("--no-preprocessed")
+    if parsed.preprocessed_dir is not None:
+        argv += ["--preprocessed-dir", parsed.preprocessed_dir] ## both stages run in <out>
+    return argv
+
+def build_pipeline(args) -> Pipeline:
+    """
+        Stages selected by the command line arguments (see init_parser). Raises ValueError if --extract-args
+        drop a feature that a selected stage reads.
+    """
+    extract_args = shlex.split(args.extract_args)
+    parsed_extract_args = parse_extract_args(extract_args)
+    features = extract_features(parsed_extract_args)
+    selected = [stage for stage, enabled in [("histograms", not args.no_histograms),
+                                             ("plots", args.plots and not args.no_histograms),
+                                             ("store", args.store is not None)] if enabled]
+    for stage in selected:
+        missing = [f for f in REQUIRED_FEATURES[stage] if f not in features]
+        if missing:
+            raise ValueError(f"The {stage} stage reads {', '.join(missing)}, which --extract-args \"{args.extract_args}\" don't save")
+
+    out = os.path.abspath(args.out)
+    state_dir = os.path.abspath(args.state) if args.state is not None else os.path.join(out, ".pipeline")
+    pipeline = Pipeline(state_dir, args.workers, args.stage_workers, force=args.force)
+    os.makedirs(out, exist_ok=True)
+    python = sys.executable
+    flags = [f"--{a}" for a in args.augment]
+
+    extracted = []
+    for name in args.datasets:
+        dataset_path = os.path.join(os.path.abspath(args.datasets_path), name)
+        datasets = [name]
+        if flags:
+            augmented = [f"{name}_{suffix}" for a in args.augment for suffix in AUGMENTATIONS[a]]
+            pipeline.add(Stage(f"augment:{name}",
+                               [python, os.path.join(config.SPATIAL_TRANSFORMS_DIR, "gen_dataset.py"), dataset_path, *flags,
+                                *shlex.split(args.augment_args)],
+                               cwd=config.SPATIAL_TRANSFORMS_DIR,
+                               inputs=[dataset_path],
+                               outputs=[os.path.join(os.path.abspath(args.datasets_path), a) for a in augmented],
+                               code=import_closure(os.path.join(config.SPATIAL_TRANSFORMS_DIR, "gen_dataset.py")),
+                               parallel=True))
+            datasets += augmented
+        for ds in datasets:
+            ds_path = os.path.join(os.path.abspath(args.datasets_path), ds)
+            pipeline.add(Stage(f"extract:{ds}",
+                               [python, os.path.join(FEATURES_DIR, "generate_features.py"), ds_path, *extract_args],
+                               cwd=out,
+                               inputs=[ds_path],
+                               outputs=[os.path.join(out, f"{ds}_{feature}.npy") for feature in features] + [os.path.join(out, f"{ds}_params.json")],
+                               code=import_closure(os.path.join(FEATURES_DIR, "generate_features.py")),
+                               deps=[f"augment:{name}"] if ds != name else [],
+                               parallel=True))
+        extracted.append((name, datasets))
+
+    if not args.no_histograms:
+        all_datasets = [ds for _, datasets in extracted for ds in datasets]
+        lbp_files = [os.path.join(out, f"{ds}_LBP.npy") for ds in all_datasets]
+        contrast_files = [os.path.join(out, f"{ds}_contrast.npy") for ds in all_datasets]
+        pipeline.add(Stage("histograms",
+                           [python, os.path.join(FEATURES_DIR, "histograms.py"), "-l", *lbp_files, "-c", *contrast_files],
+                           cwd=out,
+                           inputs=lbp_files + contrast_files,
+                           outputs=[os.path.join(out, "LBP_histograms.npz"), os.path.join(out, "contrast_histogram.npz")],
+                           code=import_closure(os.path.join(FEATURES_DIR, "histograms.py")),
+                           deps=[f"extract:{ds}" for ds in all_datasets]))
+        if args.plots:
+            for ds in all_datasets:
+                ds_path = os.path.join(os.path.abspath(args.datasets_path), ds)
+                pipeline.add(Stage(f"plots:{ds}",
+                                   [python, os.path.join(FEATURES_DIR, "plot_random.py"), ds_path, *plot_args(parsed_extract_args)],
+                                   cwd=out,
+                                   inputs=[ds_path, *(os.path.join(out, f"{ds}_{feature}.npy") for feature in REQUIRED_FEATURES["plots"]),
+                                           os.path.join(out, f"{ds}_params.json"),
+                                           os.path.join(out, "LBP_histograms.npz"), os.path.join(out, "contrast_histogram.npz")],
+                                   outputs=[os.path.join(out, f"{ds}_LBP.jpeg"), os.path.join(out, f"{ds}_sobel.jpeg")],
+                                   code=import_closure(os.path.join(FEATURES_DIR, "plot_random.py")),
+                                   deps=[f"extract:{ds}", "histograms"],
+                                   lock="plots"))
+
+    if args.store is not None:
+        for name, datasets in extracted:
+            dataset_path = os.path.join(os.path.abspath(args.datasets_path), name)
+            store_path = os.path.join(os.path.abspath(args.store), name)
+            pipeline.add(Stage(f"store:{name}",
+                               [python, os.path.join(TRAINING_DIR, "assemble.py"), dataset_path, store_path,
+                                "--prefixes", *(os.path.join(out, ds) for ds in datasets)],
+                               cwd=TRAINING_DIR,
+                               inputs=[dataset_path, *(os.path.join(out, f"{ds}_{feature}.npy") for ds in datasets for feature in REQUIRED_FEATURES["store"])],
+                               outputs=[os.path.join(store_path, "index.json")],
+                               code=import_closure(os.path.join(TRAINING_DIR, "assemble.py")),
+                               deps=[f"extract:{ds}" for ds in datasets]))
+    return pipeline
+
+def positive_int(value: str) -> int:
+    ## argparse type of the worker counts (the scheduler needs at least one free worker to start a stage)
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+def init_parser():
+    parser = argparse.ArgumentParser(description="Run the augmentation, extraction, histogram, plot and store stages, skipping those that are up to date")
+    parser.add_argument("datasets_path", type=str, help="Folder containing the datasets (augmentations are written next to them)")
+    parser.add_argument("datasets", nargs="*", default=["Glomerulus"], help="Names of the source datasets")
+    parser.add_argument("--augment", nargs="*", choices=list(AUGMENTATIONS), default=list(AUGMENTATIONS),
+                        help="gen_dataset.py augmentations (none: only the source datasets)")
+    parser.add_argument("--out", type=str, default=".", help="Folder of the feature files, histograms and plots")
+    parser.add_argument("--state", type=str, default=None, help="Folder of the stamps and logs (default: <out>/.pipeline)")
+    parser.add_argument("--workers", type=positive_int, default=os.cpu_count() or 1, help="Total number of workers shared by the running stages")
+    parser.add_argument("--stage-workers", type=positive_int, default=4, help="Maximum number of workers of a single stage")
+    parser.add_argument("--extract-args", type=str, default="", help="Extra arguments of generate_features.py (e.g. \"--shape 192 256\")")
+    parser.add_argument("--augment-args", type=str, default="", help="Extra arguments of gen_dataset.py (e.g. \"--tile 512\")")
+    parser.add_argument("--no-histograms", action="store_true", help="Skip histograms.py (and the plots)")
+    parser.add_argument("--plots", action="store_true", help="Also run plot_random.py on every dataset")
+    parser.add_argument("--store", type=str, default=None, help="Assemble a training store per source dataset in this folder")
+    parser.add_argument("--force", action="store_true", help="Run every stage, even the fresh ones")
+    parser.add_argument("--dry-run", action="store_true", help="Only print which stages are fresh and which would run")
+    return parser
+
+if __name__ == "__main__":
+    parser = init_parser()
+    args = parser.parse_args()
+    try:
+        pipeline = build_pipeline(args)
+    except ValueError as e:
+        parser.error(str(e))
+    status = pipeline.run(dry_run=args.dry_run)
+    counts = {s: list(status.values()).count(s) for s in ["fresh", "done", "stale", "failed", "blocked"] if s in status.values()}
+    print(", ".join(f"{n} {s}" for s, n in counts.items()))
+    if any(s in ("failed", "blocked") for s in status.values()):
+        sys.exit(1)
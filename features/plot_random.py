@@ -1,8 +1,11 @@
 import skimage.io
-from dataset import Dataset
+from dataset import Dataset, imread
+from preprocessed import PreprocessedImages
+import writer
+import extraction
 import numpy as np
 import matplotlib.pyplot as plt
-import sys 
+import argparse
 import os.path
 import config
 import random
@@ -25,27 +28,65 @@ def extract_img_glcm(
     contrast = contrast_matrix[n, i, j]
     return img_as_float64, contrast
  
+def init_parser():
+    parser = argparse.ArgumentParser(description="Plot the features of random images of a dataset (run in the folder of its feature files)")
+    parser.add_argument("dataset_path", type=str)
+    parser.add_argument("cutoff", type=float, nargs="?", default=float('inf'), help="Only pick images among the first CUTOFF ones")
+    ## same options as generate_features.py; by default, those saved with the feature files (<dataset>_params.json)
+    parser.add_argument("--shape", type=int, nargs=2, default=None, metavar=("H", "W"),
+                        help="Resolution the features were extracted at (default: config.SHAPE)")
+    parser.add_argument("--reduced-decode", action="store_true", help="The features were extracted with --reduced-decode")
+    parser.add_argument("--no-preprocessed", action="store_true", help="The features were extracted with --no-preprocessed")
+    parser.add_argument("--preprocessed-dir", type=str, default=None, help="Directory of the preprocessed-image tensor of the features")
+    return parser
+
 if __name__ == '__main__':
+    parser = init_parser()
+    args = parser.parse_args()
     num_imgs = 3
-    DS_PATH = sys.argv[1]
-    if (len(sys.argv) > 2):
-        CUTOFF = float(sys.argv[2])
+    DS_PATH = args.dataset_path
+    CUTOFF = args.cutoff
+    ## the images the features were extracted from: the parameters saved by generate_features.py,
+    ## unless they are given here (for feature files written without them)
+    params = writer.read_params(os.path.basename(os.path.normpath(DS_PATH)))
+    if params is None or any([args.shape, args.reduced_decode, args.no_preprocessed, args.preprocessed_dir]):
+        shape = tuple(args.shape or config.SHAPE)
+        decode_size = shape if args.reduced_decode else None
+        use_preprocessed, preprocessed_path = not args.no_preprocessed, None
     else:
-        CUTOFF = float('inf')
+        shape = tuple(params["SHAPE"])
+        decode_size = tuple(params["decode_size"]) if params["decode_size"] is not None else None
+        use_preprocessed, preprocessed_path = params["preprocessed_path"] is not None, params["preprocessed_path"]
     contrast_path = os.path.basename(DS_PATH + "_contrast.npy")
     contrast_matrix = np.load(contrast_path).reshape(-1, len(config.DISTANCES), len(config.ANGLES))
-    D : Dataset = Dataset(DS_PATH)
+    ## same images (and order) as generate_features.py, so that row i of every feature matches D[i]
+    D : Dataset = Dataset(DS_PATH, config.IGNORE_DIRS, decode_size=decode_size)
+    num_candidates = int(min(len(D), CUTOFF))
+    ## grayscale images exactly as the features see them: the rows of the tensor they were extracted from
+    ## (built once, see preprocessed.py), or only the plotted images, preprocessed here
+    gray_images = None
+    if use_preprocessed:
+        try:
+            gray_images = PreprocessedImages(D, preprocessed_path, shape=shape, directory=args.preprocessed_dir).images(n=num_candidates)
+        except OSError:
+            ## e.g. read-only location
+            pass
+
+    def as_image(featuremap: np.ndarray, i: int) -> np.ndarray:
+        if featuremap.shape[1] != shape[0] * shape[1]:
+            parser.error(f"Rows of {featuremap.shape[1]} values are not {shape[0]} x {shape[1]} feature maps (see --shape)")
+        return featuremap[i, :].reshape(shape)
 
     info = {
             "LBP": [os.path.basename(DS_PATH) + "_LBP.jpeg", 
                      "Image (left), image as graylevel (middle) \n and image representation of its local binary patterns (LBP) (right)",
-                    lambda featuremap, i: featuremap[i, :].reshape(config.SHAPE) ],
+                    as_image],
             "GLCM": [os.path.basename(DS_PATH) + "_GLCM.jpeg",
                      "Image (left), image as graylevel (middle) \n and image representation of its graylevel co-ocurrence matrix (GLCM) (right)", 
                      lambda featuremap, i: extract_img_glcm(featuremap,contrast_matrix, i)],
             "sobel": [os.path.basename(DS_PATH) + "_sobel.jpeg", 
                      "Image (left), image as graylevel (middle) \n and image representation of an application of a Sobel filter on it (right)",
-                      lambda featuremap, i: featuremap[i, :].reshape(config.SHAPE)],
+                      as_image],
             }
 
     ## Plotting
@@ -58,17 +99,22 @@ if __name__ == '__main__':
     #  plt.tight_layout()
 
     for key, (save_file, title, extractor) in info.items():
-        featuremap = np.load(os.path.basename(DS_PATH) + f"_{key}.npy")
+        featuremap_path = os.path.basename(DS_PATH) + f"_{key}.npy"
+        if not os.path.exists(featuremap_path):
+            ## e.g. dense GLCMs are only saved with generate_features.py --save-glcm
+            print(f"Skipping feature {key} ({featuremap_path} not found)")
+            continue
+        featuremap = np.load(featuremap_path)
         ## Use different random images for each transformation
-        idx = [random.randint(0, min(len(D), CUTOFF)) for _ in range(num_imgs)]
+        idx = [random.randrange(num_candidates) for _ in range(num_imgs)]
 
         fig, ax = plt.subplots(num_imgs, 3, constrained_layout=True)
         #  fig.tight_layout()
         #  fig.suptitle(title, fontsize=18)
         for ax_cnt, i in enumerate(idx):
-            main_img = skimage.io.imread(D[i])
-            main_img = skimage.transform.resize(main_img, config.SHAPE)   
-            main_img_as_gray = skimage.util.img_as_ubyte(skimage.color.rgb2gray(main_img)) # to gray_level
+            main_img = skimage.io.imread(D[i]) ## imshow already rescales it to the axes
+            # to gray_level (and resized to shape)
+            main_img_as_gray = gray_images[i] if gray_images is not None else extraction.preprocess(imread(D[i], D.decode_size), shape)
             if (key == "GLCM"):
                 feature_img, contrast = extractor(featuremap, i) 
             else:
@@ -105,7 +151,7 @@ if __name__ == '__main__':
     contrast_histogram = _compressed['contrast_histogram']
     contrast_bin_edges = _compressed['contrast_bin_edges']
 
-    idx = [random.randint(0, min(len(D), CUTOFF)) for _ in range(num_imgs)]
+    idx = [random.randrange(num_candidates) for _ in range(num_imgs)]
 
     ## LBP histograms
     fig, ax = plt.subplots(num_imgs, 3, constrained_layout=True)
@@ -115,7 +161,7 @@ if __name__ == '__main__':
         hist = lbp_histograms[i, :]
         bin_edges = lbp_bin_edges[i, :]
         main_img = skimage.io.imread(D[i])
-        lbp_img = lbp_matrix[i, :].reshape(config.SHAPE)
+        lbp_img = as_image(lbp_matrix, i)
         ax[ax_cnt][0].imshow(main_img, aspect="auto")
         # Hide ticks (numbering) in axis
         ax[ax_cnt][0].set_xticklabels([])
@@ -0,0 +1,226 @@
+import os
+import json
+import functools
+import sys
+import numpy as np
+from tqdm import tqdm
+import config
+import extraction
+import profiling
+from dataset import imread
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+from parallel import OrderedPool
+
+PREPROCESSED_VERSION = 1
+
+"""
+Preprocessed-image tensor: every image of a Dataset, preprocessed for feature extraction
+(extraction.preprocess: grayscale + resize to config.SHAPE + uint8), stored once in a single contiguous
+(N, H, W) uint8 .npy file (read as a memory map) next to the dataset ("<dataset>.preprocessed.npy",
+or "<dataset>.preprocessed_<H>x<W>.npy" for other shapes than config.SHAPE), or in another directory
+(e.g. when the dataset sits on a read-only mount).
+
+The index "<dataset>.preprocessed.json" lists the relative path, size and mtime of the source image of each row
+(in Dataset.walk() order). The tensor is rebuilt when the sources change, reusing the rows of unchanged images,
+so the expensive decode + resize only runs once per image. With a cutoff n, only the first n images are needed:
+the tensor is fresh if its first n rows are, and a build only adds the missing ones.
+"""
+
+class PreprocessedImages:
+    def __init__(self,
+                 ds,
+                 path: str|None = None,
+                 shape: tuple[int, int] = config.SHAPE,
+                 tile: int|None = None,
+                 *,
+                 directory: str|None = None):
+        """
+            The tensor is saved at path, or in directory (default: next to the dataset) under its default name.
+        """
+        self.ds = ds
+        self.shape = tuple(shape)
+        self.tile = tile ## only bounds the memory of preprocessing (same tensor)
+        suffix = "" if self.shape == tuple(config.SHAPE) else f"_{self.shape[0]}x{self.shape[1]}"
+        if ds.decode_size is not None:
+            suffix += "_reduced" ## reduced-resolution decoding (see dataset.imread) gives different pixels
+        default_path = os.path.normpath(ds.path) + f".preprocessed{suffix}.npy"
+        if path is None and directory is not None:
+            default_path = os.path.join(directory, os.path.basename(default_path))
+        self.path = path if path is not None else default_path
+        self.index_path = os.path.splitext(self.path)[0] + ".json"
+        self._fresh_rows = None ## rows found fresh by images() (the sources aren't checked again)
+
+    def _sources(self, n: int|None = None) -> list[list]:
+        ## relative path, size and mtime of the first n images (all by default)
+        sources = []
+        for filepath in self.ds.paths()[:n]:
+            st = os.stat(filepath)
+            sources.append([os.path.relpath(filepath, self.ds.path), st.st_size, st.st_mtime_ns])
+        return sources
+
+    def _params(self) -> dict:
+        params = {"version": PREPROCESSED_VERSION, "SHAPE": list(self.shape)}
+        if self.ds.decode_size is not None:
+            params["decode_size"] = list(self.ds.decode_size)
+        return params
+
+    def _load_index(self) -> dict|None:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            ## the index only describes the tensor it was written with
+            if (index.get("params") != self._params()
+                    or index.get("tensor_mtime_ns") != os.stat(self.path).st_mtime_ns):
+                return None
+        except (OSError, ValueError):
+            return None
+        return index
+
+    def is_fresh(self, n: int|None = None) -> bool:
+        ## the first n rows (all by default) match the current sources
+        index = self._load_index()
+        if index is None:
+            return False
+        sources = self._sources(n)
+        if n is None and len(index["sources"]) != len(sources):
+            return False
+        return index["sources"][:len(sources)] == sources
+
+    def build(self, workers: int = 1, n: int|None = None):
+        """
+            (Re)builds the tensor with the first n images (all by default, plus the following ones that are still
+            up to date in the current tensor): rows of images that didn't change (same relative path, size and mtime)
+            are copied from the current tensor, the others are decoded and preprocessed (in a process pool
+            with workers > 1). The new tensor and index replace the old ones atomically.
+            Raises OSError if they can't be written (e.g. read-only location); the current ones are left as they were.
+        """
+        old_index = self._load_index()
+        old_images = None
+        old_rows = {}
+        if old_index is not None:
+            old_images = np.load(self.path, mmap_mode="r")
+            old_rows = {tuple(s): i for i, s in enumerate(old_index["sources"])}
+        sources = self._sources(n)
+        if n is not None:
+            ## keep the rows after the cutoff that are still valid, so a larger cutoff later doesn't rebuild them
+            rest = self.ds.paths()[len(sources):]
+            for filepath in rest:
+                st = os.stat(filepath)
+                source = [os.path.relpath(filepath, self.ds.path), st.st_size, st.st_mtime_ns]
+                if tuple(source) not in old_rows:
+                    break
+                sources.append(source)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(len(sources), *self.shape))
+            todo = []
+            for j, source in enumerate(sources):
+                if tuple(source) in old_rows:
+                    images[j] = old_images[old_rows[tuple(source)]]
+                else:
+                    todo.append(j)
+
+            print(f"Preprocessing {len(todo)} images ({len(sources) - len(todo)} unchanged) into {self.path}")
+            filepaths = [os.path.join(self.ds.path, sources[j][0]) for j in todo]
+            with OrderedPool(workers) as pool:
+                preprocess = functools.partial(_preprocess_file, shape=self.shape, tile=self.tile, decode_size=self.ds.decode_size)
+                for j, gray in zip(todo, tqdm(pool.imap(preprocess, filepaths), total=len(todo))):
+                    images[j] = gray
+            images.flush()
+            del images, old_images
+            os.replace(tmp_path, self.path) ## atomic
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        index = {
+            "params": self._params(),
+            "tensor_mtime_ns": os.stat(self.path).st_mtime_ns,
+            "sources": sources,
+        }
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._fresh_rows = len(sources)
+
+    def images(self, workers: int = 1, n: int|None = None) -> np.ndarray:
+        """
+            The (N, H, W) uint8 tensor as a read-only memory map, (re)built first if the sources of its first n rows
+            (all by default) changed. It may have more than n rows. The sources are only checked on the first call.
+            Raises OSError if the tensor has to be built and can't be written (see build).
+        """
+        needed = len(self.ds) if n is None else min(n, len(self.ds))
+        if self._fresh_rows is None or self._fresh_rows < needed:
+            if self.is_fresh(n):
+                self._fresh_rows = needed
+            else:
+                self.build(workers, n)
+        return np.load(self.path, mmap_mode="r")
+
+    def paths(self) -> list[str]:
+        return self.ds.paths()
+
+    def lazy_apply(self,
+                   T_list: list|tuple,
+                   *,
+                   n: int|None = None,
+                   workers: int = 1,
+                   cache = None,
+                   profiler: profiling.Profiler|None = None):
+        """
+            Like Dataset.lazy_apply, but T_list is applied to the preprocessed (H, W) uint8 images (the first n only).
+            Workers read their rows straight from the memory-mapped tensor (no image is pickled).
+            With a cache (see cache.FeatureCache), entries are keyed by the preprocessed image contents.
+            With a profiler (see profiling.py), reading rows, cache accesses and each transform are timed.
+        """
+        rows = len(self.images(workers, n))
+        n = rows if n is None else min(n, rows)
+        apply = functools.partial(_load_row_and_apply, path=self.path, T_list=T_list, cache=cache, profile=profiler is not None)
+        with OrderedPool(workers) as pool:
+            for res in pool.imap(apply, range(n)):
+                yield res if profiler is None else profiler.unwrap(res)
+
+def _preprocess_file(filepath: str,
+                     shape: tuple[int, int] = config.SHAPE,
+                     tile: int|None = None,
+                     decode_size: tuple[int, int]|None = None) -> np.ndarray:
+    return extraction.preprocess(imread(filepath, decode_size), shape, tile)
+
+## memory maps opened by _load_row_and_apply (one per process), keyed by (path, mtime) so rebuilds are seen
+_opened = {}
+
+def _load_row_and_apply(j: int, path: str, T_list: list|tuple, cache = None, profile: bool = False):
+    if profile:
+        with profiling.collect() as profiler:
+            new_img = _load_row_and_apply(j, path, T_list, cache)
+        return new_img, profiler.stats
+
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _opened:
+        _opened.clear()
+        _opened[key] = np.load(path, mmap_mode="r")
+    img = profiling.timed("read_row", np.array, _opened[key][j]) ## copy of the row
+
+    if cache is not None:
+        cache_key = profiling.timed("cache_key", cache.key_array, img)
+        cached = profiling.timed("cache_get", cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+    ## apply left-to-right
+    new_img = img
+    for transform in T_list:
+        new_img = profiling.timed(profiling.stage_name(transform), transform, new_img)
+
+    if cache is not None:
+        profiling.timed("cache_put", cache.put, cache_key, new_img)
+    return new_img
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import functools
+import numpy as np
+
+"""
+Opt-in instrumentation of the dataset pipelines (Dataset.apply/lazy_apply, PreprocessedImages.lazy_apply).
+
+A Profiler accumulates, for each named stage (imread, each transform of T_list, cache lookups, imsave, ...),
+the number of calls, total/max wall time and the total size of the arrays it returned.
+Stages may be nested (e.g. "extract/resize"): code deeper in a transform opens its own stages with
+profiling.stage(name), which does nothing unless a profiler is active in the current process.
+Worker processes profile each image separately and the stats are merged back in the main process,
+so the report is the same with or without a process pool.
+"""
+
+def nbytes(obj) -> int:
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    return 0
+
+def stage_name(fn) -> str:
+    if isinstance(fn, functools.partial):
+        return stage_name(fn.func)
+    return getattr(fn, "__name__", type(fn).__name__)
+
+class Profiler:
+    def __init__(self,
+                 path: str|None = None,
+                 interval: float|None = None):
+        """
+            path: where dump() writes the JSON report (by default)
+            interval: if set, tick() also dumps the report every `interval` seconds
+        """
+        self.path = path
+        self.interval = interval
+        self.stats = {}
+        self.items = 0
+        self.lock = threading.Lock() ## imsave stages are recorded from write-behind threads
+        self.local = threading.local() ## stack of open stages, per thread
+        self.t_start = time.perf_counter()
+        self.last_dump = self.t_start
+
+    def add(self, name: str, seconds: float, out_bytes: int = 0, calls: int = 1, max_s: float|None = None):
+        with self.lock:
+            s = self.stats.setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "out_bytes": 0})
+            s["calls"] += calls
+            s["total_s"] += seconds
+            s["max_s"] = max(s["max_s"], seconds if max_s is None else max_s)
+            s["out_bytes"] += out_bytes
+
+    def merge(self, stats: dict):
+        for name, s in stats.items():
+            self.add(name, s["total_s"], s["out_bytes"], s["calls"], s["max_s"])
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+            Times the enclosed block as stage name (nested in the currently open stages, if any).
+            The yielded dict may receive the block output as "out" (counted in out_bytes).
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        full_name = "/".join(stack)
+        record = {}
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            stack.pop()
+            self.add(full_name, time.perf_counter() - t0, nbytes(record.get("out")))
+
+    def timed(self, name: str, fn, *args, **kwargs):
+        with self.stage(name) as record:
+            record["out"] = fn(*args, **kwargs)
+        return record["out"]
+
+    def unwrap(self, res: tuple):
+        """
+            (result, stats) returned by a call profiled with collect() (possibly in a worker process):
+            merges stats, counts one more item and returns result.
+        """
+        result, stats = res
+        self.merge(stats)
+        self.tick()
+        return result
+
+    def tick(self, n: int = 1):
+        """
+            Marks n more items (images) as done, dumping the report if interval seconds passed since the last dump.
+        """
+        self.items += n
+        if (self.interval is not None and time.perf_counter() - self.last_dump >= self.interval):
+            self.dump()
+
+    def report(self) -> dict:
+        wall = time.perf_counter() - self.t_start
+        with self.lock:
+            stages = {
+                name: {**s, "mean_s": s["total_s"] / s["calls"], "share": s["total_s"] / wall if wall > 0 else 0.0}
+                for name, s in sorted(self.stats.items(), key=lambda kv: -kv[1]["total_s"])
+            }
+        return {
+            "wall_s": wall,
+            "items": self.items,
+            "items_per_s": self.items / wall if wall > 0 else 0.0,
+            "stages": stages,
+        }
+
+    def dump(self, path: str|None = None):
+        path = path if path is not None else self.path
+        if path is None:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp_path, path) ## atomic, so the periodic report can be read while running
+        self.last_dump = time.perf_counter()
+
+## profiler of the image currently processed in this process (see collect), used by stage()
+_active = None
+
+@contextlib.contextmanager
+def collect():
+    """
+        Activates a fresh Profiler in this process for the enclosed block (e.g. processing one image in a worker)
+        and yields it, so that its stats can be sent back and merged into the main profiler.
+    """
+    global _active
+    previous = _active
+    _active = Profiler()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+        Profiler.stage of the active profiler, or a no-op (yielding a throwaway dict) if profiling is off.
+    """
+    if _active is None:
+        yield {}
+    else:
+        with _active.stage(name) as record:
+            yield record
+
+def timed(name: str, fn, *args, **kwargs):
+    if _active is None:
+        return fn(*args, **kwargs)
+    return _active.timed(name, fn, *args, **kwargs)
@@ -1,10 +1,6 @@
 #!/bin/bash
 
-# https://stackoverflow.com/questions/12316167/does-linux-shell-support-list-data-structure
-prefix="${1}" 
-datasets=("Glomerulus" "Glomerulus_gamma1" "Glomerulus_gamma2" "Glomerulus_gamma3" "Glomerulus_gaussian" "Glomerulus_laplace" "Glomerulus_hist_equalize2") 
-for ds in "${datasets[@]}"; 
-do 
-	python3 generate_features.py "${prefix}/${ds}" 
-done
-
+# augmentation, feature extraction and histograms of every dataset, skipping the stages that are up to date
+# (see pipeline.py; extra arguments are passed on, e.g. --workers 16 --store /path/to/stores)
+prefix="${1}"
+python3 pipeline.py "${prefix}" Glomerulus "${@:2}"
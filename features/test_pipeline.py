@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+import skimage.io
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pipeline
+
+SHAPE = (24, 32) ## not config.SHAPE
+
+def make_datasets(root):
+    ## a tiny "Glomerulus" dataset of random JPEGs
+    rng = np.random.default_rng(0)
+    folder = os.path.join(root, "Glomerulus", "Normal")
+    os.makedirs(folder)
+    for i in range(3):
+        skimage.io.imsave(os.path.join(folder, f"{i}.jpg"), rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8))
+    return str(root)
+
+def parse(datasets_path, out, *extra):
+    return pipeline.init_parser().parse_args([datasets_path, "Glomerulus", "--augment", "--out", out, "--workers", "2",
+                                              f"--extract-args=--shape {SHAPE[0]} {SHAPE[1]}", "--plots", *extra])
+
+def test_dry_run_plots_with_extract_shape(tmp_path):
+    args = parse(make_datasets(tmp_path / "datasets"), str(tmp_path / "out"), "--dry-run")
+    p = pipeline.build_pipeline(args)
+    status = p.run(dry_run=True)
+    assert status == {"extract:Glomerulus": "stale", "histograms": "stale", "plots:Glomerulus": "stale"}
+    ## the plots see the shape the features are extracted at
+    argv = p.stages["plots:Glomerulus"].argv
+    assert argv[argv.index("--shape") + 1:][:2] == [str(SHAPE[0]), str(SHAPE[1])]
+
+def test_run_plots_with_extract_shape(tmp_path, monkeypatch):
+    monkeypatch.setenv("MPLBACKEND", "Agg")
+    out = tmp_path / "out"
+    args = parse(make_datasets(tmp_path / "datasets"), str(out))
+    status = pipeline.build_pipeline(args).run()
+    assert set(status.values()) == {"done"}, status
+    assert (out / "Glomerulus_LBP.jpeg").exists() and (out / "Glomerulus_sobel.jpeg").exists()
+    ## nothing runs again
+    assert set(pipeline.build_pipeline(args).run(dry_run=True).values()) == {"fresh"}
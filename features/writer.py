@@ -0,0 +1,62 @@
+import json
+import numpy as np
+
+class FeatureWriter:
+    """
+        Streams feature rows straight into .npy files opened as memory maps
+        (np.lib.format.open_memmap), one file per feature, named "<prefix>_<feature>.npy".
+
+        Only the pages being written are resident, so memory stays bounded regardless of the number of rows,
+        and rows written before a crash are already on disk. The files are regular .npy files
+        (same names and layout as np.save would produce), readable with np.load.
+        With params, the parameters the rows were computed with (e.g. the image shape, that the row width alone
+        doesn't give) are saved in "<prefix>_params.json" (see read_params).
+    """
+    def __init__(self,
+                 prefix: str,
+                 n: int,
+                 specs: dict[str, tuple[int, np.dtype]],
+                 *,
+                 params: dict|None = None,
+                 flush_every: int = 64):
+        self.prefix = prefix
+        self.params = params
+        self.n = n
+        self.flush_every = flush_every
+        self.paths = {name: f"{prefix}_{name}.npy" for name in specs}
+        self.arrays = {
+            name: np.lib.format.open_memmap(self.paths[name], mode="w+", dtype=dtype, shape=(n, width))
+            for name, (width, dtype) in specs.items()
+        }
+        self.written = 0
+
+    def write(self, j: int, row: dict[str, np.ndarray]):
+        for name, arr in self.arrays.items():
+            arr[j, :] = row[name]
+        self.written += 1
+        if (self.written % self.flush_every == 0):
+            self.flush()
+
+    def flush(self):
+        for arr in self.arrays.values():
+            arr.flush()
+
+    def close(self):
+        self.flush()
+        for name, arr in self.arrays.items():
+            print(f"Saved {name} {arr.shape} in {self.paths[name]}")
+        self.arrays = {}
+        if self.params is not None:
+            with open(params_path(self.prefix), "w") as f:
+                json.dump(self.params, f)
+
+def params_path(prefix: str) -> str:
+    return f"{prefix}_params.json"
+
+def read_params(prefix: str) -> dict|None:
+    ## parameters saved with the "<prefix>_<feature>.npy" files (None for files written without them)
+    try:
+        with open(params_path(prefix), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -1,5 +1,6 @@
 from sys import argv
 import features
+import lut
 import numpy as np
 import skimage
 
@@ -17,13 +18,25 @@ def transform(
     """Applies light intensity change and shift. Assumes image as float (in [0,1] range). Then, processes image."""
     return np.clip(s * img + delta, 0.0, 1.0)
 
+def transform_ubyte(
+        img: np.ndarray,
+        s: float,
+        delta: float):
+    """Same as img_as_ubyte(transform(img_as_float(img), s, delta)) for an uint8 image, through a lookup table."""
+    return lut.apply_lut(img, lut.intensity_lut(s, delta))
+
+def transformed_ubyte(img: np.ndarray, s: float, delta: float):
+    if img.dtype == np.uint8:
+        return transform_ubyte(img, s, delta)
+    return skimage.util.img_as_ubyte(transform(img, s, delta))
+
 def save_transformed(img, srcpath: str, mode: str):
     if (mode == "change"):
-        new_img = skimage.util.img_as_ubyte(transform(img, scalingT, 0.0))
+        new_img = transformed_ubyte(img, scalingT, 0.0)
     elif (mode == "shift"):
-        new_img = skimage.util.img_as_ubyte(transform(img, 1.0, shiftT))
+        new_img = transformed_ubyte(img, 1.0, shiftT)
     elif (mode == "change+shift"):
-        new_img = skimage.util.img_as_ubyte(transform(img, scalingT, shiftT))
+        new_img = transformed_ubyte(img, scalingT, shiftT)
     elif (mode == ""):
         new_img = skimage.util.img_as_ubyte(img)
     else:
@@ -51,8 +64,7 @@ def main():
     srcpath, histogram_destpath, normalized_destpath, \
             opponent_destpath, opponent_hist_destpath = argv[1:6]
 
-    img = skimage.io.imread(srcpath)
-    img = skimage.util.img_as_float(img)
+    img = skimage.io.imread(srcpath) ## kept as uint8: the transforms run on lookup tables
 
     for p in argv[1:6]:
         assert(p.endswith(".jpg"))
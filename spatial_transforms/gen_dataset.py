@@ -8,6 +8,10 @@ from skimage.restoration.uft import laplacian
 import shutil
 from tqdm import tqdm
 import argparse
+import functools
+from parallel import OrderedPool, WriteBehind
+import lut
+import tiling
 
 ndim = 3 ## images (H, W, C) ==> 3-tensors, ndim=3
 sigma = 5.0
@@ -26,6 +30,10 @@ def init_parser():
     parser.add_argument("--gamma", action="store_true")
     parser.add_argument("--gaussian", action="store_true")
     parser.add_argument("--hist", action="store_true")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes applying the transforms")
+    parser.add_argument("--writers", type=int, default=4, help="Number of threads encoding and saving the output images")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="Apply the filters in tiles of TILE x TILE pixels (same output, memory bounded by the tile size: for large images)")
     return parser
 
 
@@ -51,14 +59,16 @@ def init_transforms(dataset_path) -> list:
         (
             "gaussian",
             dataset_path + "_gaussian", 
-            lambda float_img: skimage.filters.gaussian(float_img, sigma, truncate=truncate, mode="constant", cval=0, channel_axis=-1), 
+            tiling.Local(lambda float_img: skimage.filters.gaussian(float_img, sigma, truncate=truncate, mode="constant", cval=0, channel_axis=-1),
+                         tiling.gaussian_radius(sigma, truncate)),
             f"Gaussian filter with maximum std of sigma={sigma}, truncating after {truncate} standard deviations"
         ),
         *(
             (
                 "gamma",
                 dataset_path + f"_gamma{n+1}", 
-                lambda float_img: skimage.exposure.adjust_gamma(float_img, gammas[n], gain=consts[n]), 
+                ## bind gamma/gain now (a plain closure over n would see only the last value of n)
+                lut.PointTransform(lambda float_img, gamma=gammas[n], gain=consts[n]: skimage.exposure.adjust_gamma(float_img, gamma, gain=gain)), 
                 f"Gamma correction with gamma={gammas[n]} and scaling factor {consts[n]}"
             ) for n in range(len(gammas))
         ),
@@ -66,58 +76,117 @@ def init_transforms(dataset_path) -> list:
         ( 
             "laplace",
             dataset_path + f"_laplace",
-            lambda float_img: apply_laplace_filter_channelwise(float_img, ksize=ksize), 
+            tiling.Local(lambda float_img: apply_laplace_filter_channelwise(float_img, ksize=ksize), ksize // 2),
             f"Laplace operator with kernel K of size 3"
          ),
         (
                 "hist",
                 dataset_path + f"_hist",
-                lambda float_img: apply_hist_equalize_channelwise(float_img, nbins=hist_bins),
+                lut.UbyteTransform(lambda float_img: apply_hist_equalize_channelwise(float_img, nbins=hist_bins),
+                                   functools.partial(lut.equalize_hist_channelwise, nbins=hist_bins)),
                 f"Histogram equalization with {hist_bins} disjoint, equal-sized bins"
         ) 
     ]
     return img_transforms
 
-def main():
-    parser = init_parser()
-    args = parser.parse_args()
+def is_enabled(name: str, flags: dict) -> bool:
+    return flags.get(name, False)
 
-    img_transforms = init_transforms(args.dataset_path)
+def apply_transform(T, img_float: np.ndarray) -> np.ndarray:
+    new_img_float = np.clip(T(img_float), 0.0, 1.0) ## avoid precision errors like 1.0000002
+    return skimage.util.img_as_ubyte(new_img_float)
 
-    for (name, new_root, T, desc) in img_transforms:
-        # copy directory structure
-        # see https://stackoverflow.com/questions/15663695/shutil-copytree-without-files
+def apply_transform_ubyte(T, img: np.ndarray) -> np.ndarray|None:
+    """
+        uint8 fast path of apply_transform (lookup tables, see lut.py): same output bytes, but straight from the
+        decoded uint8 image, without float copies. Returns None if T has no such path (or img is not uint8).
+    """
+    if img.dtype != np.uint8 or not hasattr(T, "apply_ubyte"):
+        return None
+    return T.apply_ubyte(img)
 
-        # guard clause
-        if (name == "gaussian" and not args.gaussian) or (name == "gamma" and not args.gamma) or (name == "laplace" and not args.laplace) or (name == "hist" and not args.hist):
+def apply_transform_tiled(T, img: np.ndarray, tile: int = tiling.TILE) -> np.ndarray:
+    """
+        apply_transform(T, img_as_float(img)) for an uint8 image, in memory bounded by the tile size instead of the image size:
+        transforms with an uint8 path (lookup tables, including the global one of histogram equalization) never make
+        a float copy, and local filters (see tiling.Local) convert and filter one tile (plus halo) at a time.
+    """
+    new_img_ubyte = apply_transform_ubyte(T, img)
+    if new_img_ubyte is not None:
+        return new_img_ubyte
+    if isinstance(T, tiling.Local):
+        return tiling.apply_tiled(lambda tile_img: apply_transform(T, skimage.util.img_as_float(tile_img)), img, T.halo, tile)
+    return apply_transform(T, skimage.util.img_as_float(img))
+
+## transforms used by transform_file (set by init_worker in each worker process,
+## since the transforms are lambdas and can't be pickled)
+_worker_transforms = None
+
+def init_worker(dataset_path: str, flags: dict):
+    global _worker_transforms
+    _worker_transforms = [t for t in init_transforms(dataset_path) if is_enabled(t[0], flags)]
+
+def transform_file(filepath: str, dataset_path: str, tile: int|None = None) -> list[tuple[str, np.ndarray]]:
+    """
+        Reads and decodes the image once and applies every enabled transform to it (tile by tile if tile is set, see apply_transform_tiled).
+        Returns the list of (output path, uint8 image) pairs.
+    """
+    img = skimage.io.imread(filepath)
+    img_float = None
+    outputs = []
+    for (name, new_root, T, desc) in _worker_transforms:
+        if tile is not None:
+            outputs.append((filepath.replace(dataset_path, new_root, 1), apply_transform_tiled(T, img, tile)))
             continue
+        new_img_ubyte = apply_transform_ubyte(T, img)
+        if new_img_ubyte is None:
+            if img_float is None:
+                img_float = skimage.util.img_as_float(img) ## shared by the transforms without uint8 path
+            new_img_ubyte = apply_transform(T, img_float)
+        outputs.append((filepath.replace(dataset_path, new_root, 1), new_img_ubyte))
+    return outputs
+
+def main():
+    parser = init_parser()
+    args = parser.parse_args()
+    flags = {"gaussian": args.gaussian, "gamma": args.gamma, "laplace": args.laplace, "hist": args.hist}
+
+    img_transforms = [t for t in init_transforms(args.dataset_path) if is_enabled(t[0], flags)]
+    if img_transforms == []:
+        print("No transformation selected")
+        return
 
-        def ignore_files(dir, files):
-            return [f for f in files if os.path.isfile(os.path.join(dir, f))]
+    # copy directory structure
+    # see https://stackoverflow.com/questions/15663695/shutil-copytree-without-files
+    def ignore_files(dir, files):
+        return [f for f in files if os.path.isfile(os.path.join(dir, f))]
 
+    for (name, new_root, T, desc) in img_transforms:
         shutil.copytree(args.dataset_path, new_root, ignore=ignore_files,
                         dirs_exist_ok=True) ## the last option implies "overwrite every time"
 
+    ## single pass: each source image is read and decoded once, and every enabled transform
+    ## is applied to the same in-memory image (in a process pool with --workers > 1; point transforms
+    ## through uint8 lookup tables, the others in float),
+    ## while encoding and saving the results overlaps with the next images (write-behind threads)
+    with OrderedPool(args.workers, init_worker, (args.dataset_path, flags)) as pool, \
+            WriteBehind(threads=args.writers, max_pending=4 * max(args.workers, args.writers)) as writer:
         for cwd, cwd_subdirs, files in os.walk(args.dataset_path):
+            filepaths = [os.path.join(cwd, file) for file in files if any([file.endswith(ext) for ext in allowed_extensions])]
+            results = pool.imap(functools.partial(transform_file, dataset_path=args.dataset_path, tile=args.tile), filepaths)
+
             ## use tqdm progress bar if in leaf directory (no other subdirectories), which means the images are being created
             if cwd_subdirs == []:
-                progress_bar_iterable = tqdm(files)
-                print(f"Creating folder {cwd.replace(args.dataset_path, new_root)}")
-            else:
-                progress_bar_iterable = files
+                results = tqdm(results, total=len(filepaths))
+                for (name, new_root, T, desc) in img_transforms:
+                    print(f"Creating folder {cwd.replace(args.dataset_path, new_root)}")
             
-            for file in progress_bar_iterable: ## use progress bar
-                if not any([file.endswith(ext) for ext in allowed_extensions]):
-                    continue
-                filepath = os.path.join(cwd, file)
-                img = skimage.io.imread(filepath)
-                img_float = skimage.util.img_as_float(img)
-            
-                new_img_float = np.clip(T(img_float), 0.0, 1.0) ## avoid precision errors like 1.0000002
-                new_img_ubyte = skimage.util.img_as_ubyte(new_img_float)
-                new_filepath = filepath.replace(args.dataset_path, new_root, 1)
-                skimage.io.imsave(new_filepath, new_img_ubyte, check_contrast=False)
-        
+            for outputs in results: ## use progress bar
+                for new_filepath, new_img_ubyte in outputs:
+                    writer.submit(skimage.io.imsave, new_filepath, new_img_ubyte, check_contrast=False)
+    
+    for (name, new_root, T, desc) in img_transforms:
         print(f"Finalized transformation '{desc}'")
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import numpy as np
+import skimage.util
+
+"""
+Lookup-table (LUT) fast paths for point transforms of uint8 images.
+
+A point transform maps every pixel value independently (gamma correction, intensity change/shift, ...),
+so on a uint8 image it is fully described by its output on the 256 possible values.
+The table is computed with the same float pipeline as the original transform (img_as_float -> f -> clip ->
+img_as_ubyte), so applying it yields the exact same bytes, without allocating float64 copies of the image.
+
+Histogram equalization is not a point transform of the whole dataset, but it is one for each channel of a
+given image: its LUT is built from the histogram (bincount) of the channel.
+"""
+
+LEVELS = 256
+
+## the 256 possible values of a uint8 image, as floats (exactly as img_as_float converts them)
+_levels_float = skimage.util.img_as_float(np.arange(LEVELS, dtype=np.uint8))
+
+def point_lut(f) -> np.ndarray:
+    """
+        LUT (256 uint8 entries) of the point transform f (float image in [0, 1] -> float image),
+        clipping its output to [0, 1] like gen_dataset.apply_transform.
+    """
+    return skimage.util.img_as_ubyte(np.clip(f(_levels_float), 0.0, 1.0))
+
+def apply_lut(img: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    if img.dtype != np.uint8:
+        raise ValueError(f"Expected an uint8 image, got {img.dtype}")
+    return np.take(lut, img)
+
+def gamma_lut(gamma: float, c: float = 1.0) -> np.ndarray:
+    """
+        LUT of transforms.gamma_correction (c * img ** gamma).
+    """
+    return point_lut(lambda x: c * (x ** gamma))
+
+def intensity_lut(s: float, delta: float) -> np.ndarray:
+    """
+        LUT of features_extract.transform (light intensity change s and shift delta: s * img + delta).
+    """
+    return point_lut(lambda x: s * x + delta)
+
+def equalize_hist_lut(channel: np.ndarray, nbins: int = 256) -> np.ndarray:
+    """
+        LUT of skimage.exposure.equalize_hist(img_as_float(channel), nbins) for an uint8 channel.
+        skimage takes the histogram of the float image over [min, max] and interpolates its cdf at each pixel:
+        here the histogram is computed over the (at most 256) distinct levels, weighted by their counts.
+    """
+    counts = np.bincount(channel.ravel(), minlength=LEVELS)
+    present = np.flatnonzero(counts)
+    levels = _levels_float[present]
+    hist, edges = np.histogram(levels, bins=nbins, range=(levels[0], levels[-1]), weights=counts[present])
+    cdf = hist.cumsum()
+    cdf = cdf / float(cdf[-1])
+    bin_centers = (edges[:-1] + edges[1:]) / 2
+    lut = np.zeros(LEVELS, dtype=np.uint8)
+    lut[present] = skimage.util.img_as_ubyte(np.clip(np.interp(levels, bin_centers, cdf), 0.0, 1.0))
+    return lut
+
+def equalize_hist_channelwise(img: np.ndarray, nbins: int = 256) -> np.ndarray:
+    """
+        uint8 version of gen_dataset.apply_hist_equalize_channelwise (one LUT per channel, last axis).
+    """
+    out = np.empty_like(img)
+    for i in range(img.shape[-1]):
+        out[..., i] = apply_lut(img[..., i], equalize_hist_lut(img[..., i], nbins=nbins))
+    return out
+
+class PointTransform:
+    """
+        Float point transform f (float image -> float image) with an uint8 fast path:
+        T(float_img) == f(float_img) and T.apply_ubyte(img) == img_as_ubyte(clip(f(img_as_float(img)), 0, 1)).
+        The LUT is built on the first apply_ubyte call. Picklable if f is.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.lut = None
+
+    def __call__(self, float_img: np.ndarray) -> np.ndarray:
+        return self.f(float_img)
+
+    def apply_ubyte(self, img: np.ndarray) -> np.ndarray:
+        if self.lut is None:
+            self.lut = point_lut(self.f)
+        return apply_lut(img, self.lut)
+
+class UbyteTransform:
+    """
+        Float transform f with an uint8 fast path apply_ubyte (uint8 image -> uint8 image) giving the same bytes,
+        e.g. histogram equalization (f = gen_dataset.apply_hist_equalize_channelwise, fast = equalize_hist_channelwise).
+    """
+    def __init__(self, f, fast):
+        self.f = f
+        self.fast = fast
+
+    def __call__(self, float_img: np.ndarray) -> np.ndarray:
+        return self.f(float_img)
+
+    def apply_ubyte(self, img: np.ndarray) -> np.ndarray:
+        return self.fast(img)
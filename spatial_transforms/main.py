@@ -4,6 +4,7 @@ import os
 import matplotlib.pyplot as plt
 import transforms
 import time
+import argparse
 
 DATASET_PATH = "Glomerulus"
 MAX_ITER = 1
@@ -11,53 +12,101 @@ c = 1.5
 gamma = 0.7
 N = 10
 sigma = 5.0
+REPEATS = 3
+REFERENCE_CROP = 48 ## the per-pixel reference implementation only runs on a small crop
 
 def switch_T(img: np.ndarray, t: str):
     if t == "gamma":
         return transforms.gamma_correction(img, gamma=gamma, c=c)
     elif t == "gauss":
-        return transforms.GaussianFilter.apply_gaussian_filter(img, N=N, sigma=sigma) 
+        return transforms.GaussianFilter.apply_gaussian_filter(img, N=N, sigma=sigma)
+
+def init_parser():
+    parser = argparse.ArgumentParser(description="Benchmark our Gaussian filter against skimage.filters.gaussian")
+    parser.add_argument("--path", type=str, default=os.path.join(DATASET_PATH, "Normal/treino/AZAN"),
+                        help="Folder of test images (synthetic 768x1024 RGB images are used if it doesn't exist)")
+    parser.add_argument("--max-iter", type=int, default=MAX_ITER, help="Number of images")
+    parser.add_argument("-N", type=int, default=N, help="Kernel half-size (kernel is (2N + 1) x (2N + 1))")
+    parser.add_argument("--sigma", type=float, default=sigma)
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Best time over this many runs")
+    parser.add_argument("--plot", action="store_true", help="Show original image and both filtered images")
+    return parser
+
+def load_images(path: str, max_iter: int):
+    if os.path.isdir(path):
+        files = os.listdir(path)
+        print(f"Found {len(files)} images in {path}")
+        for f in files[:max_iter]:
+            yield f, skimage.img_as_float(skimage.io.imread(os.path.join(path, f)))
+    else:
+        print(f"{path} not found, using synthetic images")
+        rng = np.random.default_rng(0)
+        for i in range(max_iter):
+            yield f"synthetic_{i}", rng.random((768, 1024, 3))
+
+def best_time(f, repeats: int) -> tuple[float, np.ndarray]:
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = f()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def benchmark(img: np.ndarray, N: int, sigma: float, repeats: int = REPEATS) -> dict:
+    """
+        Times our Gaussian filter (two 1-D passes and FFT) and skimage.filters.gaussian (same support,
+        truncate = N / sigma), and measures the differences between them (and against the per-pixel
+        reference implementation, on a small crop).
+    """
+    G = transforms.GaussianFilter
+    results = {}
+    outputs = {}
+    for method in ("separable", "fft"):
+        results[f"time_{method}"], outputs[method] = best_time(lambda: G.apply_gaussian_filter(img, N=N, sigma=sigma, method=method), repeats)
+    results["time_skimage"], outputs["skimage"] = best_time(lambda: skimage.filters.gaussian(img, sigma=sigma, truncate=N / sigma,
+                                                                                           mode="constant", cval=0.0,
+                                                                                           channel_axis=-1), repeats)
+    crop = img[:REFERENCE_CROP, :REFERENCE_CROP]
+    reference = G.apply_gaussian_filter_reference(crop, N=N, sigma=sigma)
+    results["max_diff_reference"] = float(np.abs(G.apply_gaussian_filter(crop, N=N, sigma=sigma) - reference).max())
+    ## uint8 images: both methods must give the reference's bytes
+    crop_ubyte = skimage.util.img_as_ubyte(np.clip(crop, 0.0, 1.0))
+    reference_ubyte = G.apply_gaussian_filter_reference(crop_ubyte, N=N, sigma=sigma).astype(np.int64)
+    for method in ("separable", "fft"):
+        out_ubyte = G.apply_gaussian_filter(crop_ubyte, N=N, sigma=sigma, method=method)
+        results[f"max_diff_reference_ubyte_{method}"] = int(np.abs(out_ubyte.astype(np.int64) - reference_ubyte).max())
+    results["max_diff_separable_fft"] = float(np.abs(outputs["separable"] - outputs["fft"]).max())
+    ## skimage normalizes the (truncated) kernel to sum 1, so a small difference is expected
+    results["max_diff_skimage"] = float(np.abs(outputs["separable"] - outputs["skimage"]).max())
+    return results, outputs
 
 if __name__ == "__main__":
-    test_subpath = "Normal/treino/AZAN"
-    complete_path = os.path.join(DATASET_PATH, test_subpath)
-    
-    print(f"Searching on path {complete_path}")
-    files = os.listdir(complete_path)
-    print(f"Found {len(files)} images")
-    
-    i: int = 0
-    for f in files:
-        prepended_f = os.path.join(complete_path, f)
-        img = skimage.img_as_float(skimage.io.imread(prepended_f))
-        
-        t0 = time.time()
-        my_gaussian = transforms.GaussianFilter.apply_gaussian_filter(img, N=N, sigma=sigma) 
-        t1 = time.time()
-        print(f"My gaussian took {t1 - t0} seconds")
-        t0 = time.time()
-        skimage_gaussian = skimage.filters.gaussian(img, sigma=sigma,
-                                                    mode="constant",
-                                                    cval=0.0,
-                                                    channel_axis=-1)
-        t1 = time.time()
-        print(f"Skimage's gaussian took {t1 - t0} seconds")
-        
-        fig, axis = plt.subplots(2, 2)
-        
-        for i, arr, title in zip(
-            range(2 * 2), 
-            (img, my_gaussian, skimage_gaussian),
-            ("Original image",
-             f"My gaussian transform (N={N}, sigma={sigma})",
-             f"Skimage's gaussian transform (sigma={sigma})")
-        ):
-            axis[i // 2, i % 2].imshow(arr)
-            axis[i // 2, i % 2].axis("off")
-            axis[i // 2, i % 2].set_title(title)
-        
-        plt.show()
-        
-        i += 1
-        if i >= MAX_ITER:
-            break
\ No newline at end of file
+    args = init_parser().parse_args()
+
+    for f, img in load_images(args.path, args.max_iter):
+        results, outputs = benchmark(img, args.N, args.sigma, args.repeats)
+        print(f"{f} {img.shape} (N={args.N}, sigma={args.sigma})")
+        print(f"My gaussian (separable) took {results['time_separable']:.4f} seconds")
+        print(f"My gaussian (FFT) took {results['time_fft']:.4f} seconds")
+        print(f"Skimage's gaussian took {results['time_skimage']:.4f} seconds")
+        print(f"Max difference to reference (per-pixel) implementation: {results['max_diff_reference']:.3e}")
+        print(f"Max difference to reference on uint8 images (separable, FFT): "
+              f"{results['max_diff_reference_ubyte_separable']}, {results['max_diff_reference_ubyte_fft']}")
+        print(f"Max difference separable/FFT: {results['max_diff_separable_fft']:.3e}")
+        print(f"Max difference to skimage: {results['max_diff_skimage']:.3e}")
+
+        if args.plot:
+            fig, axis = plt.subplots(2, 2)
+
+            for i, arr, title in zip(
+                range(2 * 2),
+                (img, outputs["separable"], outputs["skimage"]),
+                ("Original image",
+                 f"My gaussian transform (N={args.N}, sigma={args.sigma})",
+                 f"Skimage's gaussian transform (sigma={args.sigma})")
+            ):
+                axis[i // 2, i % 2].imshow(np.clip(arr, 0.0, 1.0))
+                axis[i // 2, i % 2].axis("off")
+                axis[i // 2, i % 2].set_title(title)
+
+            plt.show()
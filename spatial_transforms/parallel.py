@@ -0,0 +1,72 @@
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class OrderedPool:
+    """
+        Process pool yielding results in input order (multiprocessing.Pool.imap).
+        With workers <= 1 everything runs in the calling process (the initializer included),
+        so the serial and parallel modes share the exact same code path.
+        Functions (and initializer arguments) must be picklable, i.e. module-level.
+    """
+    def __init__(self, workers: int = 1, initializer=None, initargs: tuple = ()):
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.pool = None
+
+    def __enter__(self):
+        if (self.workers > 1):
+            self.pool = multiprocessing.Pool(self.workers, self.initializer, self.initargs)
+        elif self.initializer is not None:
+            self.initializer(*self.initargs)
+        return self
+
+    def imap(self, fn, iterable):
+        if self.pool is None:
+            return map(fn, iterable)
+        return self.pool.imap(fn, iterable)
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+class WriteBehind:
+    """
+        Bounded write-behind queue: runs write calls (e.g. JPEG encoding + skimage.io.imsave) on a thread pool,
+        so that encoding and disk writes overlap with the computation of the next images.
+        At most max_pending writes are queued (submit blocks beyond that), bounding the memory held by pending images.
+        Errors raised by a write are re-raised by submit/close.
+    """
+    def __init__(self, threads: int = 4, max_pending: int = 16):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        self._check()
+        self.slots.acquire()
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _check(self):
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result() ## re-raises errors
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
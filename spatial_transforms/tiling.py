@@ -0,0 +1,61 @@
+import numpy as np
+
+"""
+Tiled processing of large images: a local transform (each output pixel only depends on the input pixels at most
+`halo` pixels away) is applied to overlapping tiles, each one read with a halo of that size around it,
+and the interior of each result is stitched into the output. Since every interior pixel sees the same neighborhood
+as in the whole image (and tiles on the border of the image see its actual border), the output is exactly the same,
+but the float temporaries of the transform only ever cover one tile (plus halo).
+
+Halos of the usual filters:
+    Gaussian (ndimage/skimage):  gaussian_radius(sigma, truncate)
+    k x k kernels (Laplace, Sobel): k // 2
+    LBP of radius R:            ceil(R) + 1 (bilinear interpolation of the circle points)
+"""
+
+TILE = 512 ## default tile edge (pixels)
+
+def gaussian_radius(sigma: float, truncate: float = 4.0) -> int:
+    ## kernel radius of scipy.ndimage.gaussian_filter (and skimage.filters.gaussian)
+    return int(truncate * float(sigma) + 0.5)
+
+def tiles(shape: tuple[int, int], tile: int = TILE):
+    """
+        Yields the bounds (r0, r1, c0, c1) of the tiles covering an image of shape (H, W), row by row.
+    """
+    for r0 in range(0, shape[0], tile):
+        for c0 in range(0, shape[1], tile):
+            yield r0, min(shape[0], r0 + tile), c0, min(shape[1], c0 + tile)
+
+def with_halo(bounds: tuple[int, int, int, int], halo: int, shape: tuple[int, int]) -> tuple[int, int, int, int]:
+    ## bounds grown by halo on every side, clipped to the image
+    r0, r1, c0, c1 = bounds
+    return max(0, r0 - halo), min(shape[0], r1 + halo), max(0, c0 - halo), min(shape[1], c1 + halo)
+
+class Local:
+    """
+        Transform f whose output pixels only depend on the input pixels at most halo pixels away,
+        so it can be applied tile by tile (see apply_tiled). Picklable if f is.
+    """
+    def __init__(self, f, halo: int):
+        self.f = f
+        self.halo = halo
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        return self.f(img)
+
+def apply_tiled(f, img: np.ndarray, halo: int, tile: int = TILE) -> np.ndarray:
+    """
+        f(img) for a local transform f (halo as above) mapping an (H, W, ...) image to an (H, W, ...) image,
+        computed tile by tile. The output is allocated from the first tile's dtype and trailing shape.
+    """
+    shape = img.shape[:2]
+    out = None
+    for bounds in tiles(shape, tile):
+        r0, r1, c0, c1 = bounds
+        R0, R1, C0, C1 = with_halo(bounds, halo, shape)
+        res = f(img[R0:R1, C0:C1])
+        if out is None:
+            out = np.empty(shape + res.shape[2:], dtype=res.dtype)
+        out[r0:r1, c0:c1] = res[r0 - R0:r1 - R0, c0 - C0:c1 - C0]
+    return out
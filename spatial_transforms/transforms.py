@@ -3,6 +3,8 @@
 import skimage
 from skimage import io
 import numpy as np
+import convolution
+import lut
 
 DATASET_PATH = "Glomerulus"
 
@@ -16,41 +18,56 @@ def gamma_correction(img: np.ndarray, gamma: float=1.0, c: float=1.0):
     
     return np.clip(c * (img ** gamma), 0.0, 1.0) # element-wise operations
 
+def gamma_correction_ubyte(img: np.ndarray, gamma: float=1.0, c: float=1.0):
+    """
+    Same as img_as_ubyte(gamma_correction(img_as_float(img), gamma, c)) for an uint8 image,
+    computed with a lookup table
+    """
+    assert(len(img.shape) == 3) # (C, H, W) or (H, W, C)
+
+    return lut.apply_lut(img, lut.gamma_lut(gamma, c))
+
 class GaussianFilter:
     @staticmethod 
     def gaussian(x: float, sigma: float):
         return (1.0 / (np.sqrt(2 * np.pi) * sigma)) * np.exp(- x**2 / (2.0 * sigma**2))
     
+    @staticmethod
+    def init_kernel_1d(N: int, sigma: float) -> np.ndarray:
+        return GaussianFilter.gaussian(np.arange(start=-N, stop=N + 1).astype(np.float64), sigma)
+
     @staticmethod
     def init_kernel(N: int, sigma: float) -> np.ndarray:
-        gaussian_arr = GaussianFilter.gaussian(np.arange(start=-N, stop=N + 1).astype(np.float64), sigma)
+        gaussian_arr = GaussianFilter.init_kernel_1d(N, sigma)
         
         # return tensor outer product
         return np.outer(gaussian_arr, gaussian_arr)
     
     @staticmethod
-    def apply_gaussian_filter(img: np.ndarray, N: int, sigma: float) -> np.ndarray:
+    def apply_gaussian_filter(img: np.ndarray, N: int, sigma: float, *, channel_axis: int = -1, method: str = "auto") -> np.ndarray:
+        """
+            Filters (a batch (..., H, W, C) of) images, or a single (H, W) grayscale image, with the (2N + 1) x (2N + 1)
+            Gaussian kernel, with zero padding (for a batch of grayscale images, pass channel_axis=None).
+            The kernel is separable, so this runs as two vectorized 1-D passes (or an FFT convolution for
+            large N, see convolution.py) instead of a (2N + 1)^2 product per pixel.
+        """
+        out = convolution.gaussian_filter(img, GaussianFilter.init_kernel_1d(N, sigma), channel_axis=channel_axis, method=method)
+        return out.astype(img.dtype, copy=False)
+
+    @staticmethod
+    def apply_gaussian_filter_reference(img: np.ndarray, N: int, sigma: float) -> np.ndarray:
+        """
+            Direct (per pixel) implementation of apply_gaussian_filter on a single (H, W, C) image.
+            Very slow: only meant to validate the vectorized implementation on small images.
+        """
         output_img = np.zeros_like(img)
         filter = GaussianFilter.init_kernel(N, sigma) # (2N + 1) times (2N + 1)
-        #print(f"Original img shape: {img.shape}") ## TODO REMOVE
         for c in range(img.shape[2]):
-            #print(f"_: {img[:, :, c].shape}") ## TODO REMOVE
             padded_channel = np.pad(img[:, :, c], ((N, N), (N, N)), 
                                     constant_values=((0,0),(0,0)),
                                     mode="constant")
-            #print(f"Shape of total padded channel {padded_channel.shape}") ## TODO REMOVE
             for i in range(N, img.shape[0] + N):
                 for j in range(N, img.shape[1] + N):
-                    #print(f"Shape of patch: {padded_channel[i - N: i + N + 1, j - N: j + N + 1].shape} \t Shape of filter: {filter.shape}") ## TODO REMOVE
                     conv = padded_channel[i - N: i + N + 1, j - N: j + N + 1] * filter ## element-wise product
                     output_img[i - N][j - N][c] = np.sum(conv)
         return output_img
-                    
-    
-
-        
-        
-        
-        
-    
-     
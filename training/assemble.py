@@ -0,0 +1,90 @@
+import os
+import sys
+import argparse
+import numpy as np
+from tqdm import tqdm
+from store import StoreWriter, TRAIN, TEST
+
+## the dataset layer (image paths, in feature row order) lives in the sibling folder features
+FEATURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "features")
+sys.path.append(FEATURES_DIR)
+import config
+from dataset import Dataset
+
+"""
+Assembles the "flat" feature vectors of the model (by default LBP + Sobel + contrast, i.e. 2 * H * W + 5 values
+for features extracted at H x W, see generate_features.py --shape) straight from the .npy files written by
+generate_features.py into a feature store (see store.py), without one .npz file per sample.
+
+Row j of every feature file belongs to the j-th image of the dataset (Dataset.walk() order), whose relative path
+gives the label (class folder, first component) and the split (a "treino"/"train" or "teste"/"test" component).
+Labels are the indices of the classes in sorted order, like torchvision's DatasetFolder.
+"""
+
+FLAT_FEATURES = ["LBP", "sobel", "contrast"] ## column order of the flat vectors
+SPLIT_NAMES = {"treino": TRAIN, "train": TRAIN, "teste": TEST, "test": TEST}
+CHUNK_ROWS = 256
+
+def sample_split(rel_path: str) -> int:
+    for part in rel_path.split(os.sep):
+        if part in SPLIT_NAMES:
+            return SPLIT_NAMES[part]
+    raise ValueError(f"No split folder ({'/'.join(SPLIT_NAMES)}) in {rel_path}")
+
+def sample_class(rel_path: str) -> str:
+    return rel_path.split(os.sep)[0]
+
+def assemble(dataset_path: str,
+             store_path: str,
+             prefixes: list[str],
+             features: list[str] = FLAT_FEATURES,
+             *,
+             class_names: list[str]|None = None,
+             ignore_dirs: list[str] = config.IGNORE_DIRS):
+    """
+        Writes the concatenation of `features` of every sample into a new store at store_path.
+        Each prefix (e.g. "Glomerulus", "Glomerulus_gamma1": features of an augmentation of the same dataset)
+        contributes one sample per feature row, labeled after the corresponding image of dataset_path.
+    """
+    ds = Dataset(dataset_path, ignore_dirs)
+    rel_paths = [os.path.relpath(p, dataset_path) for p in ds.paths()]
+    if class_names is None:
+        class_names = sorted(set(sample_class(p) for p in rel_paths))
+    labels = np.array([class_names.index(sample_class(p)) for p in rel_paths], dtype=np.float32)
+    splits = np.array([sample_split(p) for p in rel_paths], dtype=np.uint8)
+
+    mats = {prefix: [np.load(f"{prefix}_{name}.npy", mmap_mode="r") for name in features] for prefix in prefixes}
+    widths = [m.shape[1] for m in mats[prefixes[0]]]
+    for prefix, ms in mats.items():
+        if [m.shape[1] for m in ms] != widths or len(set(m.shape[0] for m in ms)) != 1:
+            raise ValueError(f"Feature files of {prefix} don't match those of {prefixes[0]}")
+        if ms[0].shape[0] > len(rel_paths):
+            raise ValueError(f"{prefix} has more rows ({ms[0].shape[0]}) than {dataset_path} has images ({len(rel_paths)})")
+    n = sum(ms[0].shape[0] for ms in mats.values())
+
+    print(f"Assembling {n} samples of {' + '.join(features)} ({sum(widths)} values) into {store_path}")
+    with StoreWriter(store_path, n, sum(widths), class_names=class_names, features=list(zip(features, widths))) as writer:
+        start = 0
+        for prefix, ms in mats.items():
+            rows = ms[0].shape[0]
+            for a in tqdm(range(0, rows, CHUNK_ROWS), desc=prefix):
+                b = min(rows, a + CHUNK_ROWS)
+                X = np.concatenate([m[a:b].astype(np.float32) for m in ms], axis=1)
+                names = [f"{prefix}:{p}" for p in rel_paths[a:b]]
+                writer.write_rows(start + a, X, labels[a:b], splits[a:b], names)
+            start += rows
+
+def init_parser():
+    parser = argparse.ArgumentParser(description="Assemble flat feature vectors (from generate_features.py outputs) into a feature store")
+    parser.add_argument("dataset_path", type=str, help="Dataset the features were extracted from (gives labels and splits)")
+    parser.add_argument("store_path", type=str)
+    parser.add_argument("--prefixes", nargs="+", default=None,
+                        help="Prefixes of the feature files (<prefix>_<feature>.npy), by default the dataset name")
+    parser.add_argument("--features", nargs="+", default=FLAT_FEATURES, help="Features concatenated in each flat vector, in order")
+    parser.add_argument("--class-names", nargs="+", default=None, help="Classes of label 0, 1, ... (default: sorted class folders)")
+    return parser
+
+if __name__ == "__main__":
+    args = init_parser().parse_args()
+    prefixes = args.prefixes if args.prefixes is not None else [os.path.basename(os.path.normpath(args.dataset_path))]
+    assemble(args.dataset_path, args.store_path, prefixes, args.features, class_names=args.class_names)
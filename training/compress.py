@@ -0,0 +1,239 @@
+import os
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+from store import FeatureStore, StoreWriter, TRAIN
+import assemble ## puts the features folder (config, histograms) on sys.path
+import config
+import histograms
+
+"""
+Compression stage: turns a feature store of flat vectors (LBP + Sobel maps + contrast, about 2 * H * W values)
+into a store of compact vectors (hundreds of values), to shrink the input layer of the MLP.
+
+Each output feature is computed from one feature (column block) of the input store:
+
+    hist:<feature>          normalized count of each LBP code (256 values)
+    uniform:<feature>       normalized histogram of the rotation-invariant uniform LBP codes (P + 2 values),
+                            mapped from the default LBP codes with a 256-entry table (see uniform_lut)
+    pca:<feature>:<k>       projection on the first k principal components, fitted with incremental PCA
+    proj:<feature>:<k>      Gaussian random projection to k dimensions (no fitting, fixed seed)
+    keep:<feature>          the feature as is (e.g. keep:contrast)
+
+The input store is streamed in chunks of rows: one pass fits every PCA (on the training split only),
+another one writes the compressed vectors. The fitted parameters are saved with the output store
+("<store>/compress.npz" and "<store>/compress.json"), so new vectors can be compressed the same way (Compressor.load).
+"""
+
+CHUNK_ROWS = 512
+LEVELS = 256
+
+def uniform_lut(P: int = config.P) -> np.ndarray:
+    """
+        Rotation-invariant uniform code (skimage's method="uniform") of each default LBP code of P bits:
+        the number of 1 bits for codes with at most 2 circular 0/1 transitions, P + 1 for the others.
+    """
+    codes = np.arange(2**P)
+    bits = (codes[:, None] >> np.arange(P)) & 1
+    transitions = np.sum(bits != np.roll(bits, 1, axis=1), axis=1)
+    lut = np.where(transitions <= 2, bits.sum(axis=1), P + 1)
+    return np.pad(lut, (0, LEVELS - len(lut)), constant_values=P + 1).astype(np.uint8)
+
+def code_histograms(codes: np.ndarray, levels: int) -> np.ndarray:
+    ## normalized counts of the (uint8) codes of each row
+    return (histograms.level_counts(codes, levels) / codes.shape[1]).astype(np.float32)
+
+class IncrementalPCA:
+    """
+        PCA fitted chunk by chunk (Ross et al., "Incremental Learning for Robust Visual Tracking", as in
+        sklearn.decomposition.IncrementalPCA): each partial_fit takes an SVD of the current components (scaled by
+        their singular values), the new centered chunk and a mean correction row, so memory stays O((k + chunk) * D).
+        Chunks must have at least k rows (except the last ones), so the first one can't be shorter.
+    """
+    def __init__(self, n_components: int):
+        self.n_components = n_components
+        self.n_seen = 0
+        self.mean = None
+        self.var = None
+        self.components = None
+        self.singular_values = None
+
+    def partial_fit(self, X: np.ndarray):
+        X = np.asarray(X, dtype=np.float64)
+        n = X.shape[0]
+        if self.n_seen == 0 and n < self.n_components:
+            raise ValueError(f"The first chunk has {n} rows, fewer than the {self.n_components} components")
+        n_total = self.n_seen + n
+        batch_mean = X.mean(axis=0)
+        batch_var = X.var(axis=0)
+        if self.n_seen == 0:
+            mean, var = batch_mean, batch_var
+            stacked = X - batch_mean
+        else:
+            ## Chan et al. update of the mean and variance
+            delta = batch_mean - self.mean
+            mean = self.mean + delta * n / n_total
+            var = (self.var * self.n_seen + batch_var * n + delta**2 * self.n_seen * n / n_total) / n_total
+            mean_correction = np.sqrt(self.n_seen * n / n_total) * (self.mean - batch_mean)
+            stacked = np.vstack((self.singular_values[:, None] * self.components, X - batch_mean, mean_correction))
+        _, S, Vt = np.linalg.svd(stacked, full_matrices=False)
+        ## deterministic signs: largest loading of each component positive
+        signs = np.sign(Vt[np.arange(len(Vt)), np.abs(Vt).argmax(axis=1)])
+        Vt *= signs[:, None]
+        k = min(self.n_components, len(S))
+        self.components, self.singular_values = Vt[:k], S[:k]
+        self.mean, self.var, self.n_seen = mean, var, n_total
+
+    def explained_variance_ratio(self) -> np.ndarray:
+        ## var is the population variance of each column (n_seen samples)
+        return self.singular_values**2 / (self.var.sum() * self.n_seen)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return ((X - self.mean) @ self.components.T).astype(np.float32)
+
+def parse_spec(spec: str) -> tuple[str, str, int|None]:
+    ## "pca:sobel:64" -> ("pca", "sobel", 64)
+    parts = spec.split(":")
+    op = parts[0]
+    if op in ("pca", "proj"):
+        if len(parts) != 3:
+            raise ValueError(f"Expected {op}:<feature>:<k>, got {spec}")
+        return op, parts[1], int(parts[2])
+    if op in ("hist", "uniform", "keep") and len(parts) == 2:
+        return op, parts[1], None
+    raise ValueError(f"Unknown compression {spec} (hist, uniform, pca, proj or keep)")
+
+class Compressor:
+    def __init__(self, specs: list[str], features: list[tuple[str, int]], *, seed: int = 0):
+        """
+            specs: output features (see module docstring), in column order; features: layout of the input vectors.
+        """
+        self.specs = [parse_spec(spec) for spec in specs]
+        self.features = [tuple(f) for f in features]
+        self.seed = seed
+        self.uniform = uniform_lut()
+        self.pca = {}
+        self.projections = {}
+        rng = np.random.default_rng(seed)
+        for op, feature, k in self.specs:
+            width = self.width(feature)
+            if op in ("pca", "proj") and not 1 <= k <= width:
+                raise ValueError(f"{op}:{feature}:{k}: k must be between 1 and the width of {feature} ({width})")
+            if op == "pca":
+                self.pca[(feature, k)] = IncrementalPCA(k)
+            elif op == "proj":
+                self.projections[(feature, k)] = (rng.standard_normal((width, k)) / np.sqrt(k)).astype(np.float32)
+
+    def columns(self, name: str) -> slice:
+        start = 0
+        for feature, width in self.features:
+            if feature == name:
+                return slice(start, start + width)
+            start += width
+        raise KeyError(f"No feature {name} in {[f for f, _ in self.features]}")
+
+    def width(self, name: str) -> int:
+        cols = self.columns(name)
+        return cols.stop - cols.start
+
+    def output_features(self) -> list[tuple[str, int]]:
+        out = []
+        for op, feature, k in self.specs:
+            if op == "hist":
+                out.append((f"{feature}_hist", LEVELS))
+            elif op == "uniform":
+                out.append((f"{feature}_uniform_hist", config.P + 2))
+            elif op in ("pca", "proj"):
+                out.append((f"{feature}_{op}{k}", k))
+            else:
+                out.append((feature, self.width(feature)))
+        return out
+
+    def partial_fit(self, X: np.ndarray):
+        for (feature, _), pca in self.pca.items():
+            pca.partial_fit(X[:, self.columns(feature)])
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        out = []
+        for op, feature, k in self.specs:
+            block = X[:, self.columns(feature)]
+            if op == "hist":
+                out.append(code_histograms(block.astype(np.uint8), LEVELS))
+            elif op == "uniform":
+                out.append(code_histograms(self.uniform[block.astype(np.uint8)], config.P + 2))
+            elif op == "pca":
+                out.append(self.pca[(feature, k)].transform(block))
+            elif op == "proj":
+                out.append(block.astype(np.float32) @ self.projections[(feature, k)])
+            else:
+                out.append(block.astype(np.float32))
+        return np.concatenate(out, axis=1)
+
+    def save(self, path: str):
+        arrays = {}
+        for (feature, k), pca in self.pca.items():
+            arrays[f"pca:{feature}:{k}:mean"] = pca.mean
+            arrays[f"pca:{feature}:{k}:components"] = pca.components
+        with open(os.path.join(path, "compress.json"), "w") as f:
+            json.dump({"specs": [":".join(str(p) for p in s if p is not None) for s in self.specs],
+                       "features": [list(f) for f in self.features],
+                       "seed": self.seed}, f)
+        np.savez(os.path.join(path, "compress.npz"), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Compressor":
+        with open(os.path.join(path, "compress.json")) as f:
+            meta = json.load(f)
+        compressor = cls(meta["specs"], meta["features"], seed=meta["seed"])
+        with np.load(os.path.join(path, "compress.npz")) as arrays:
+            for (feature, k), pca in compressor.pca.items():
+                pca.mean = arrays[f"pca:{feature}:{k}:mean"]
+                pca.components = arrays[f"pca:{feature}:{k}:components"]
+        return compressor
+
+def compress_store(src_path: str, dst_path: str, specs: list[str], *, chunk_rows: int = CHUNK_ROWS, seed: int = 0):
+    src = FeatureStore(src_path)
+    compressor = Compressor(specs, src.features, seed=seed)
+
+    if compressor.pca:
+        train = src.indices(TRAIN)
+        max_k = max(k for _, k in compressor.pca)
+        for feature, k in compressor.pca:
+            if k > len(train):
+                raise ValueError(f"pca:{feature}:{k}: fitting {k} components needs at least {k} training samples, "
+                                 f"{src_path} has {len(train)}")
+        ## PCA chunks need at least k rows: chunks are at least max_k rows, and a short last chunk is merged into the previous one
+        fit_rows = max(chunk_rows, max_k)
+        starts = list(range(0, len(train), fit_rows))
+        if len(starts) > 1 and len(train) - starts[-1] < max_k:
+            starts.pop()
+        bounds = starts[1:] + [len(train)]
+        for a, b in tqdm(list(zip(starts, bounds)), desc="fit"):
+            compressor.partial_fit(np.asarray(src.X[train[a:b]]))
+        for (feature, k), pca in compressor.pca.items():
+            print(f"PCA of {feature}: {k} components, {100 * pca.explained_variance_ratio().sum():.1f}% of the variance")
+
+    out_features = compressor.output_features()
+    dim = sum(width for _, width in out_features)
+    print(f"Compressing {len(src)} samples: {src.dim} -> {dim} values ({', '.join(f'{f} {w}' for f, w in out_features)})")
+    with StoreWriter(dst_path, len(src), dim, class_names=src.class_names, features=out_features) as writer:
+        for a in tqdm(range(0, len(src), chunk_rows), desc="transform"):
+            b = min(len(src), a + chunk_rows)
+            writer.write_rows(a, compressor.transform(np.asarray(src.X[a:b])), src.y[a:b], src.split[a:b], src.samples[a:b])
+    compressor.save(dst_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress the feature vectors of a store (LBP histograms, incremental PCA, random projection)")
+    parser.add_argument("src_store", type=str)
+    parser.add_argument("dst_store", type=str)
+    parser.add_argument("specs", nargs="+",
+                        help="Output features, in order: hist:<f>, uniform:<f>, pca:<f>:<k>, proj:<f>:<k> or keep:<f> "
+                             "(e.g. hist:LBP uniform:LBP pca:sobel:64 keep:contrast)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows read from the input store at a time")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random projections")
+    args = parser.parse_args()
+    try:
+        compress_store(args.src_store, args.dst_store, args.specs, chunk_rows=args.chunk_rows, seed=args.seed)
+    except ValueError as e:
+        parser.error(str(e))
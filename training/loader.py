@@ -0,0 +1,84 @@
+import threading
+import queue
+import numpy as np
+import torch
+from store import FeatureStore, batches
+
+class BatchLoader:
+    """
+        Replacement for torch.utils.data.DataLoader over a FeatureStore split: iterating yields (feat, label)
+        float32 tensors of batch_size samples, like DataLoader over the per-sample .npz DatasetFolder did.
+
+        Each batch is one bulk read of the memory-mapped feature matrix, and a background thread reads up to
+        `prefetch` batches ahead, so loading overlaps with the forward/backward passes of the model.
+        Shuffling draws a new random partition into batches at every epoch (iteration).
+    """
+    def __init__(self,
+                 store: FeatureStore,
+                 split: int|None = None,
+                 batch_size: int = 64,
+                 *,
+                 shuffle: bool = True,
+                 drop_last: bool = False,
+                 prefetch: int = 4,
+                 pin_memory: bool = False,
+                 seed: int|None = None):
+        self.store = store
+        self.indices = store.indices(split)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.pin_memory = pin_memory
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.indices) // self.batch_size
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+    def _to_tensors(self, idx: np.ndarray) -> tuple[torch.Tensor, torch.Tensor]:
+        X, y = self.store.batch(idx)
+        feat, label = torch.from_numpy(X), torch.from_numpy(y)
+        if self.pin_memory:
+            feat, label = feat.pin_memory(), label.pin_memory()
+        return feat, label
+
+    def __iter__(self):
+        index_batches = batches(self.indices, self.batch_size, shuffle=self.shuffle, rng=self.rng, drop_last=self.drop_last)
+        if self.prefetch <= 0:
+            yield from map(self._to_tensors, index_batches)
+            return
+
+        ## producer thread: reads batches ahead into a bounded queue (None marks the end)
+        q = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for idx in index_batches:
+                    if stop.is_set():
+                        return
+                    q.put(self._to_tensors(idx))
+                q.put(None)
+            except BaseException as e:
+                q.put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            ## iteration interrupted (e.g. break): unblock and stop the producer
+            stop.set()
+            while thread.is_alive():
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.01)
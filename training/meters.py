@@ -0,0 +1,153 @@
+import torch
+
+"""
+Confusion-matrix meter of the training loop, kept on the device of the model.
+
+The counts of every threshold are a (T, 4) int64 tensor, updated with a single bincount per batch
+(no .item() per batch): the host only reads them (one transfer) when a metric is asked for, i.e. in
+save_epoch / Writer.print_info, and keeps that copy until the next update.
+"""
+
+## columns of the counts: bincount code 2 * predicted + actual
+COL_TN, COL_FN, COL_FP, COL_TP = range(4)
+
+class Meter:
+    def __init__(self, thresholds: list[float]|tuple[float, ...] = (0.5,)):
+        """
+            Counts are kept for each threshold (metrics default to the first one, see the `t` argument).
+        """
+        self.thresholds = list(thresholds)
+        self.counts : torch.Tensor|None = None ## allocated on the device of the first batch
+        self._host = None
+        self.total : int = 0
+        self.history : dict[str, list[float]] = {
+            "acc": [],
+            "precision": [],
+            "recall": [],
+            "specificity": [],
+            "f1_score": []
+        }
+
+    def reset(self, del_history = False):
+        if self.counts is not None:
+            self.counts.zero_()
+        self._host = None
+        self.total = 0
+        if del_history:
+            self.history = {
+                "acc": [],
+                "precision": [],
+                "recall": [],
+                "specificity": [],
+                "f1_score": []
+            }
+
+    def update(self,
+               out: torch.Tensor,
+               labels: torch.Tensor,
+               threshold: float|None = None):
+        """
+        We consider by default that probabilities exactly 0.5 correspond to label 0
+        (out > threshold is predicted positive). threshold overrides the thresholds of a single-threshold meter.
+        """
+        if threshold is not None and len(self.thresholds) != 1:
+            raise ValueError("threshold can only be overridden in a single-threshold meter")
+        with torch.no_grad():
+            thresholds = self.thresholds if threshold is None else [threshold]
+            T = len(thresholds)
+            if self.counts is None or self.counts.device != out.device:
+                counts = torch.zeros((T, 4), dtype=torch.int64, device=out.device)
+                if self.counts is not None:
+                    counts += self.counts.to(out.device)
+                self.counts = counts
+            thr = torch.as_tensor(thresholds, dtype=out.dtype, device=out.device)
+            hard_out = out.reshape(1, -1) > thr.reshape(-1, 1) ## (T, B)
+            actual = (labels.reshape(1, -1) == 1.0)
+            ## code of each (threshold, sample) pair: 4 * threshold index + 2 * predicted + actual
+            code = 2 * hard_out.long() + actual.long() + 4 * torch.arange(T, device=out.device).reshape(-1, 1)
+            self.counts += torch.bincount(code.reshape(-1), minlength=4 * T).reshape(T, 4)
+        self._host = None
+        self.total += len(labels)
+
+    def confusion(self) -> list[list[int]]:
+        """
+            Host copy of the counts: [TN, FN, FP, TP] for each threshold (synchronizes with the device once).
+        """
+        if self._host is None:
+            self._host = self.counts.tolist() if self.counts is not None else [[0] * 4 for _ in self.thresholds]
+        return self._host
+
+    @property
+    def TN(self) -> int:
+        return self.confusion()[0][COL_TN]
+
+    @property
+    def FN(self) -> int:
+        return self.confusion()[0][COL_FN]
+
+    @property
+    def FP(self) -> int:
+        return self.confusion()[0][COL_FP]
+
+    @property
+    def TP(self) -> int:
+        return self.confusion()[0][COL_TP]
+
+    def save_epoch(self, reset=True):
+        self.history["acc"].append(self.acc())
+        self.history["precision"].append(self.precision())
+        self.history["recall"].append(self.recall())
+        self.history["specificity"].append(self.specificity())
+        self.history["f1_score"].append(self.f1_score())
+        if reset:
+            self.reset(del_history=False)
+
+    def acc(self, t: int = 0):
+        c = self.confusion()[t]
+        return (c[COL_TP] + c[COL_TN]) / self.total
+
+    def precision(self, t: int = 0):
+        """
+        Positive predictive value (PPV)
+        -- proportion of true positives to output positives
+        """
+        c = self.confusion()[t]
+        try:
+            return (c[COL_TP]) / (c[COL_TP] + c[COL_FP])
+        except ZeroDivisionError:
+            return float('inf')
+
+    def recall(self, t: int = 0):
+        """
+        True positive rate (TPV)
+        -- how many of actual positives were identified
+        """
+        c = self.confusion()[t]
+        try:
+            return (c[COL_TP]) / (c[COL_TP] + c[COL_FN])
+        except ZeroDivisionError:
+            return float('inf')
+
+    def specificity(self, t: int = 0):
+        """
+        True negative rate (TNV)
+        -- how many negatives were identified
+        """
+        c = self.confusion()[t]
+        try:
+            return (c[COL_TN]) / (c[COL_TN] + c[COL_FP])
+        except ZeroDivisionError:
+            return float('inf')
+
+    def f1_score(self, t: int = 0):
+        """
+        Harmonic mean of precision and sensitivity/recall:
+        F1 = 2 / (1/precision + 1/recall)
+        F1 = (2 * precision * recall) / (precision + recall)
+        """
+        try:
+            P = self.precision(t)
+            R = self.recall(t)
+            return (2 * P * R) / (P + R)
+        except ZeroDivisionError:
+            return float('inf')
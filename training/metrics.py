@@ -0,0 +1,126 @@
+import numpy as np
+
+"""
+Exact ROC and precision-recall curves of a binary classifier.
+
+Instead of recounting TP/FP/TN/FN over the whole test set at each of a fixed grid of thresholds, the scores
+are sorted once (descending) and the counts at every distinct score are cumulative sums of the sorted labels,
+so the full curves (every operating point, not a resolution-limited subset) cost O(n log n).
+
+At the operating point of threshold t, samples with score >= t are predicted positive.
+"""
+
+def to_numpy(x) -> np.ndarray:
+    ## torch tensors (possibly on the GPU) as well as arrays
+    if hasattr(x, "detach"):
+        x = x.detach().cpu().numpy()
+    return np.asarray(x).reshape(-1)
+
+def cumulative_counts(scores: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        (thresholds, TP, FP): distinct scores in decreasing order, and the number of true and false positives
+        when predicting positive all samples with score >= threshold.
+    """
+    scores = to_numpy(scores)
+    labels = to_numpy(labels) == 1
+    order = np.argsort(-scores, kind="stable")
+    scores, labels = scores[order], labels[order]
+    ## last position of each run of equal scores: ties are all predicted positive together
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tp = np.cumsum(labels)[last]
+    fp = last + 1 - tp
+    return scores[last], tp, fp
+
+def roc_curve(scores: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        (FPR, TPR, thresholds), from (0, 0) (threshold +inf) to (1, 1).
+    """
+    thresholds, tp, fp = cumulative_counts(scores, labels)
+    if tp[-1] == 0 or fp[-1] == 0:
+        raise ValueError("ROC curve needs both positive and negative samples")
+    tpr = np.r_[0.0, tp / tp[-1]]
+    fpr = np.r_[0.0, fp / fp[-1]]
+    return fpr, tpr, np.r_[np.inf, thresholds]
+
+def pr_curve(scores: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        (recall, precision, thresholds), by increasing recall, starting at (0, 1) (threshold +inf).
+    """
+    thresholds, tp, fp = cumulative_counts(scores, labels)
+    if tp[-1] == 0:
+        raise ValueError("Precision-recall curve needs positive samples")
+    recall = np.r_[0.0, tp / tp[-1]]
+    precision = np.r_[1.0, tp / (tp + fp)]
+    return recall, precision, np.r_[np.inf, thresholds]
+
+def auc(x: np.ndarray, y: np.ndarray) -> float:
+    ## trapezoidal rule (x sorted)
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2))
+
+def roc_auc(scores: np.ndarray, labels: np.ndarray) -> float:
+    fpr, tpr, _ = roc_curve(scores, labels)
+    return auc(fpr, tpr)
+
+def average_precision(scores: np.ndarray, labels: np.ndarray) -> float:
+    """
+        AP = sum over operating points of (R_k - R_(k-1)) * P_k (step interpolation, no trapezoids,
+        which would be too optimistic for PR curves).
+    """
+    recall, precision, _ = pr_curve(scores, labels)
+    return float(np.sum(np.diff(recall) * precision[1:]))
+
+class CurveAccumulator:
+    """
+        Collects the scores and labels of a model over batches (e.g. the test loader), then gives the exact curves.
+        Each update copies the batch to host memory once; nothing is recomputed per threshold.
+    """
+    def __init__(self):
+        self.scores = []
+        self.labels = []
+
+    def reset(self):
+        self.scores = []
+        self.labels = []
+
+    def update(self, out, labels):
+        self.scores.append(to_numpy(out).astype(np.float64))
+        self.labels.append(to_numpy(labels))
+
+    def merge(self, other: "CurveAccumulator"):
+        self.scores.extend(other.scores)
+        self.labels.extend(other.labels)
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        ## concatenated once, then kept as a single batch
+        if len(self.scores) > 1:
+            self.scores = [np.concatenate(self.scores)]
+            self.labels = [np.concatenate(self.labels)]
+        if not self.scores:
+            return np.zeros(0), np.zeros(0)
+        return self.scores[0], self.labels[0]
+
+    def confusion(self, threshold: float = 0.5) -> dict[str, int]:
+        """
+            TP, TN, FP, FN at threshold, with Meter's convention (score > threshold is positive).
+        """
+        scores, labels = self.arrays()
+        hard_out = scores > threshold
+        positive = labels == 1
+        return {
+            "TP": int(np.sum(hard_out & positive)),
+            "TN": int(np.sum(~hard_out & ~positive)),
+            "FP": int(np.sum(hard_out & ~positive)),
+            "FN": int(np.sum(~hard_out & positive)),
+        }
+
+    def roc_curve(self):
+        return roc_curve(*self.arrays())
+
+    def pr_curve(self):
+        return pr_curve(*self.arrays())
+
+    def roc_auc(self) -> float:
+        return roc_auc(*self.arrays())
+
+    def average_precision(self) -> float:
+        return average_precision(*self.arrays())
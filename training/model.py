@@ -0,0 +1,51 @@
+import torch
+import torch.nn as nn
+
+class MLP(nn.Module):
+    def __init__(self,
+                 feat_dim: int,
+                 layers: list,
+                 dropouts: list,
+                 leak: float = 0.02,
+                 use_batch_norm: bool = True):
+        super().__init__()
+
+        self.dropouts = dropouts
+        self.ext_layers = [feat_dim] + layers
+        ## for each hidden layer i there is a dropout in the connection
+        ## (i - 1) -> i, and there is a final dropout from the final hidden
+        ## to the output layer
+        assert len(layers) + 1 == len(dropouts)
+
+        ## TODO add customizable batch normalization or instance normalization
+        self.model = nn.ModuleList()
+        self.model.append(nn.BatchNorm1d(feat_dim))
+        for i in range(len(self.ext_layers) - 1):
+            self.model.append(nn.Linear(self.ext_layers[i], self.ext_layers[i + 1]))
+            self.model.append(nn.Dropout(self.dropouts[i]))
+            self.model.append(nn.LeakyReLU(negative_slope=leak, inplace=True))
+            if use_batch_norm:
+                self.model.append(nn.BatchNorm1d(self.ext_layers[i + 1]))
+        self.model.append(nn.Linear(self.ext_layers[-1], 1))
+        self.model.append(nn.Dropout(self.dropouts[-1]))
+        self.model.append(nn.Sigmoid())
+
+    def forward(self, feat: torch.Tensor) -> torch.Tensor:
+        for layer in self.model:
+            feat = layer(feat)
+        return feat.flatten()
+
+    @classmethod
+    def from_state_dict(cls, state: dict, leak: float = 0.02) -> "MLP":
+        """
+            Rebuilds the model saved by train_loop (a state_dict) for inference: feat_dim, layers and use_batch_norm
+            are read from the shapes of the saved parameters (dropouts don't matter in eval mode, leak does).
+        """
+        def index(key: str) -> int:
+            return int(key.split(".")[1]) ## "model.<i>.<param>"
+        linear = sorted((index(k), v) for k, v in state.items() if k.endswith(".weight") and v.dim() == 2)
+        batch_norms = [k for k in state if k.endswith(".running_mean")]
+        layers = [w.shape[0] for _, w in linear[:-1]]
+        model = cls(linear[0][1].shape[1], layers, [0.0] * (len(layers) + 1), leak, use_batch_norm=len(batch_norms) > 1)
+        model.load_state_dict(state)
+        return model
@@ -0,0 +1,260 @@
+import os
+import io
+import sys
+import csv
+import json
+import time
+import queue
+import threading
+import argparse
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import torch
+from model import MLP
+from assemble import FLAT_FEATURES ## also puts the features folder on sys.path
+import config
+import extraction
+from dataset import Dataset, imread
+
+sys.path.append(config.SPATIAL_TRANSFORMS_DIR)
+from parallel import OrderedPool
+
+"""
+Scores new images with a trained MLP checkpoint (the state_dict saved by train_loop in the notebook):
+image -> preprocessing at the model resolution -> LBP + Sobel + contrast flat vector (as assemble.py builds it) -> model.
+
+The checkpoint is loaded once; images are featurized by a pool of worker processes and go through the model
+in batches. Inputs are image files, directories (walked recursively) or "-" (image paths read from stdin, one per line).
+Output: CSV with the path and the probability of a lesion (class LESION_CLASS) of each image.
+
+    python score.py model1/checkpoint.pth.tar slides/ --workers 8 > scores.csv
+
+With --serve PORT, a local HTTP server scores images POSTed as raw bytes (response: JSON). Concurrent requests
+are grouped into micro-batches (up to --batch-size images, waiting at most --max-wait ms for more).
+
+    curl --data-binary @img.jpg http://localhost:8000/
+"""
+
+## input resolution of the model (IMG_SIZE in the notebook)
+IMG_SIZE = (192, 256)
+## labels 0 and 1 of the training store (sorted class folders, see assemble.py)
+CLASS_NAMES = ["Crescente", "Normal"]
+LESION_CLASS = "Crescente"
+
+def feature_vector(img: np.ndarray, shape: tuple[int, int] = IMG_SIZE) -> np.ndarray:
+    row = extraction.extract(img, props=[f for f in FLAT_FEATURES if f in extraction.PROPS], shape=shape)
+    return np.concatenate([row[name].astype(np.float32) for name in FLAT_FEATURES])
+
+def _featurize(item: tuple, shape: tuple[int, int], from_bytes: bool = False, reduced_decode: bool = False) -> tuple:
+    ## (key, image path or bytes) -> (key, flat vector, error message); a bad image doesn't stop the others
+    key, source = item
+    try:
+        img = imread(io.BytesIO(source) if from_bytes else source, shape if reduced_decode else None)
+        return key, feature_vector(img, shape), None
+    except Exception as e:
+        return key, None, f"{type(e).__name__}: {e}"
+
+class Scorer:
+    def __init__(self,
+                 checkpoint_path: str,
+                 *,
+                 shape: tuple[int, int] = IMG_SIZE,
+                 leak: float = 0.02,
+                 device: str = "cpu",
+                 workers: int = 1,
+                 batch_size: int = 64,
+                 class_names: list[str] = CLASS_NAMES,
+                 lesion_class: str = LESION_CLASS,
+                 reduced_decode: bool = False):
+        self.shape = tuple(shape)
+        self.reduced_decode = reduced_decode ## must match how the training features were generated
+        self.device = device
+        self.batch_size = batch_size
+        self.lesion_class = lesion_class
+        self.lesion_label = class_names.index(lesion_class)
+        self.model = MLP.from_state_dict(torch.load(checkpoint_path, map_location=device), leak).to(device)
+        self.model.eval()
+        specs = extraction.feature_specs([f for f in FLAT_FEATURES if f in extraction.PROPS], shape=self.shape)
+        feat_dim = sum(specs[name][0] for name in FLAT_FEATURES)
+        if self.model.ext_layers[0] != feat_dim:
+            raise ValueError(f"Checkpoint expects {self.model.ext_layers[0]} features, images of shape {self.shape} give {feat_dim}")
+        self.pool = OrderedPool(workers)
+
+    def __enter__(self):
+        self.pool.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.__exit__(*exc)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        ## probability of a lesion for each row of X; the model outputs P(label 1)
+        with torch.inference_mode():
+            out = self.model(torch.from_numpy(X).to(self.device)).cpu().numpy()
+        return out if self.lesion_label == 1 else 1.0 - out
+
+    def score(self, items, *, from_bytes: bool = False):
+        """
+            Yields (key, probability, error) for each (key, image path or bytes) of items, in order.
+            items may be a stream (e.g. a generator over stdin): images are featurized as they arrive.
+        """
+        featurize = functools.partial(_featurize, shape=self.shape, from_bytes=from_bytes, reduced_decode=self.reduced_decode)
+        pending = []
+        num_vectors = 0
+        for key, x, error in self.pool.imap(featurize, items):
+            pending.append((key, x, error))
+            num_vectors += x is not None
+            if num_vectors == self.batch_size:
+                yield from self._flush(pending)
+                pending, num_vectors = [], 0
+        yield from self._flush(pending)
+
+    def _flush(self, pending: list):
+        vectors = [x for _, x, _ in pending if x is not None]
+        probs = iter(self.predict(np.stack(vectors)) if vectors else [])
+        for key, x, error in pending:
+            yield key, (float(next(probs)) if x is not None else None), error
+
+class MicroBatcher:
+    """
+        Groups concurrent requests into batches for the scorer (a single thread owns the scorer):
+        a batch is closed when it has max_batch images or max_wait seconds after its first request.
+    """
+    def __init__(self, scorer: Scorer, max_batch: int, max_wait: float):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, data: bytes) -> float:
+        request = {"data": data, "done": threading.Event(), "prob": None, "error": None}
+        self.requests.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise ValueError(request["error"])
+        return request["prob"]
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                for j, prob, error in self.scorer.score(enumerate(r["data"] for r in batch), from_bytes=True):
+                    batch[j]["prob"], batch[j]["error"] = prob, error
+            except Exception as e:
+                for request in batch:
+                    request["error"] = f"{type(e).__name__}: {e}"
+            for request in batch:
+                request["done"].set()
+
+def serve(scorer: Scorer, host: str, port: int, max_wait: float):
+    batcher = MicroBatcher(scorer, scorer.batch_size, max_wait)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply(200, {"status": "ok", "shape": list(scorer.shape)})
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            start = time.perf_counter()
+            try:
+                prob = batcher.submit(data)
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, {"probability": prob, "class": scorer.lesion_class, "seconds": time.perf_counter() - start})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Scoring on http://{host}:{port}/ (POST image bytes)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def input_items(inputs: list[str]):
+    ## (path, path) for each image of inputs, lazily (stdin is read as it comes)
+    for entry in inputs:
+        if entry == "-":
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.strip(), line.strip()
+        elif os.path.isdir(entry):
+            for path in Dataset(entry, use_manifest=False).paths():
+                yield path, path
+        else:
+            yield entry, entry
+
+def init_parser():
+    parser = argparse.ArgumentParser(description="Lesion probabilities of images, with a trained MLP checkpoint")
+    parser.add_argument("checkpoint", type=str, help="state_dict saved by train_loop")
+    parser.add_argument("inputs", nargs="*", default=["-"], help="Images, directories or - (paths from stdin)")
+    parser.add_argument("--shape", type=int, nargs=2, default=list(IMG_SIZE), metavar=("H", "W"),
+                        help="Resolution the model was trained at (features are extracted at it)")
+    parser.add_argument("--reduced-decode", action="store_true",
+                        help="Reduced-resolution JPEG decoding (use it if the training features were generated with --reduced-decode)")
+    parser.add_argument("--leak", type=float, default=0.02, help="LeakyReLU slope of the model")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (decoding and feature extraction)")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Images per model call (results of a stream are written per batch: use 1 for the lowest latency)")
+    parser.add_argument("--class-names", nargs=2, default=CLASS_NAMES, help="Classes of label 0 and 1")
+    parser.add_argument("--lesion-class", type=str, default=LESION_CLASS)
+    parser.add_argument("--output", type=str, default=None, help="CSV file (default: stdout)")
+    parser.add_argument("--serve", type=int, default=None, metavar="PORT", help="Serve over HTTP instead of scoring inputs")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--max-wait", type=float, default=10.0, help="Maximum wait (ms) for a micro-batch to fill up")
+    return parser
+
+if __name__ == "__main__":
+    args = init_parser().parse_args()
+    scorer = Scorer(args.checkpoint,
+                    shape=args.shape,
+                    leak=args.leak,
+                    device=args.device,
+                    workers=args.workers,
+                    batch_size=args.batch_size,
+                    class_names=args.class_names,
+                    lesion_class=args.lesion_class,
+                    reduced_decode=args.reduced_decode)
+    with scorer:
+        if args.serve is not None:
+            serve(scorer, args.host, args.serve, args.max_wait / 1000)
+        else:
+            f = open(args.output, "w", newline="") if args.output is not None else sys.stdout
+            out = csv.writer(f)
+            out.writerow(["path", f"P({args.lesion_class})"])
+            total, errors = 0, 0
+            for path, prob, error in scorer.score(input_items(args.inputs)):
+                out.writerow([path, prob if prob is not None else ""])
+                f.flush()
+                total += 1
+                if error is not None:
+                    errors += 1
+                    print(f"{path}: {error}", file=sys.stderr)
+            if f is not sys.stdout:
+                f.close()
+            print(f"Scored {total} images ({errors} errors)", file=sys.stderr)
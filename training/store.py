@@ -0,0 +1,196 @@
+import os
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+"""
+Feature store for training: every sample (train and test) in one contiguous float32 matrix, read as a memory map.
+
+    <store>/X.npy       (N, D) float32   feature vectors ("flat" vectors)
+    <store>/y.npy       (N,)   float32   labels (index of the class in class_names, as 0.0/1.0 for BCELoss)
+    <store>/split.npy   (N,)   uint8     TRAIN or TEST
+    <store>/index.json  dimension, class names, feature layout ([name, width] pairs, in column order)
+                        and the name (e.g. source path) of each sample
+
+Batches are read with a single (sorted) fancy-indexing read of X, instead of opening one file per sample.
+index.json is written last, so a store is only opened once it is complete.
+"""
+
+STORE_VERSION = 1
+TRAIN = 0
+TEST = 1
+SPLITS = {"train": TRAIN, "test": TEST}
+
+class StoreWriter:
+    """
+        Streams samples into a new store (see module docstring), row by row.
+    """
+    def __init__(self,
+                 path: str,
+                 n: int,
+                 dim: int,
+                 *,
+                 class_names: list[str],
+                 features: list[tuple[str, int]]|None = None,
+                 flush_every: int = 256):
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "index.json")):
+            os.remove(os.path.join(path, "index.json")) ## incomplete until closed
+        self.path = path
+        self.n = n
+        self.dim = dim
+        self.class_names = list(class_names)
+        self.features = [list(f) for f in features] if features is not None else [["flat", dim]]
+        if sum(width for _, width in self.features) != dim:
+            raise ValueError(f"Feature widths {self.features} don't add up to dimension {dim}")
+        self.flush_every = flush_every
+        self.X = np.lib.format.open_memmap(os.path.join(path, "X.npy"), mode="w+", dtype=np.float32, shape=(n, dim))
+        self.y = np.zeros(n, dtype=np.float32)
+        self.split = np.zeros(n, dtype=np.uint8)
+        self.samples = [None] * n
+        self.written = 0
+
+    def write(self, j: int, x: np.ndarray, label: int, split: int, name: str|None = None):
+        self.X[j, :] = x
+        self.y[j] = label
+        self.split[j] = split
+        self.samples[j] = name
+        self.written += 1
+        if (self.written % self.flush_every == 0):
+            self.X.flush()
+
+    def write_rows(self, start: int, X: np.ndarray, labels: np.ndarray, splits: np.ndarray, names: list[str]|None = None):
+        stop = start + X.shape[0]
+        self.X[start:stop, :] = X
+        self.y[start:stop] = labels
+        self.split[start:stop] = splits
+        self.samples[start:stop] = names if names is not None else [None] * X.shape[0]
+        self.written += X.shape[0]
+        self.X.flush()
+
+    def close(self):
+        self.X.flush()
+        del self.X
+        np.save(os.path.join(self.path, "y.npy"), self.y)
+        np.save(os.path.join(self.path, "split.npy"), self.split)
+        index = {
+            "version": STORE_VERSION,
+            "n": self.n,
+            "dim": self.dim,
+            "class_names": self.class_names,
+            "features": self.features,
+            "samples": self.samples,
+        }
+        tmp_path = os.path.join(self.path, f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+        print(f"Saved store of {self.n} samples x {self.dim} features in {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+class FeatureStore:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+        if self.index.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported feature store version {self.index.get('version')} in {path}")
+        self.path = path
+        self.X = np.load(os.path.join(path, "X.npy"), mmap_mode="r")
+        self.y = np.load(os.path.join(path, "y.npy"))
+        self.split = np.load(os.path.join(path, "split.npy"))
+        self.class_names = self.index["class_names"]
+        self.features = [tuple(f) for f in self.index["features"]]
+        self.samples = self.index["samples"]
+
+    @property
+    def dim(self) -> int:
+        return self.X.shape[1]
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def indices(self, split: int|None = None) -> np.ndarray:
+        if split is None:
+            return np.arange(len(self))
+        return np.flatnonzero(self.split == split)
+
+    def columns(self, name: str) -> slice:
+        """
+            Columns of feature name in X (see the feature layout in index.json).
+        """
+        start = 0
+        for feature, width in self.features:
+            if feature == name:
+                return slice(start, start + width)
+            start += width
+        raise KeyError(name)
+
+    def batch(self, idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+            (X[idx], y[idx]) with one bulk read; idx should be sorted for sequential disk access (see batches).
+        """
+        return np.asarray(self.X[idx]), self.y[idx]
+
+def batches(indices: np.ndarray,
+            batch_size: int,
+            *,
+            shuffle: bool = True,
+            rng: np.random.Generator|None = None,
+            drop_last: bool = False):
+    """
+        Yields index batches: a random partition of indices into batches (if shuffle), each one sorted,
+        so that it is read from the memory map in file order (the order inside a batch doesn't matter for SGD).
+    """
+    if shuffle:
+        rng = rng if rng is not None else np.random.default_rng()
+        indices = rng.permutation(indices)
+    stop = len(indices) - (len(indices) % batch_size if drop_last else 0)
+    for start in range(0, stop, batch_size):
+        yield np.sort(indices[start:start + batch_size])
+
+def folder_samples(folder: str, extensions: tuple[str, ...] = ("npy", "npz")) -> tuple[list[str], list[tuple[str, int]]]:
+    """
+        Classes and (path, class index) samples of a torchvision.datasets.DatasetFolder layout
+        (<folder>/<class>/**/<file>), in the same order and with the same class indices as DatasetFolder.
+    """
+    classes = sorted(entry.name for entry in os.scandir(folder) if entry.is_dir())
+    samples = []
+    for class_index, target_class in enumerate(classes):
+        for root, _, fnames in sorted(os.walk(os.path.join(folder, target_class), followlinks=True)):
+            for fname in sorted(fnames):
+                if fname.lower().endswith(extensions):
+                    samples.append((os.path.join(root, fname), class_index))
+    return classes, samples
+
+def convert_folders(train_folder: str, test_folder: str, path: str, key: str = "flat"):
+    """
+        Converts the per-sample .npz files of the notebook (DatasetFolder layout, array `key` in each file)
+        into a feature store, with the same class indices (labels) as DatasetFolder.
+    """
+    classes, train_samples = folder_samples(train_folder)
+    test_classes, test_samples = folder_samples(test_folder)
+    if test_classes != classes:
+        raise ValueError(f"Train classes {classes} and test classes {test_classes} differ")
+    samples = [(p, c, TRAIN) for p, c in train_samples] + [(p, c, TEST) for p, c in test_samples]
+    with np.load(samples[0][0]) as first:
+        dim = first[key].size
+    with StoreWriter(path, len(samples), dim, class_names=classes) as writer:
+        for j, (filepath, class_index, split) in enumerate(tqdm(samples)):
+            with np.load(filepath) as a:
+                writer.write(j, a[key].reshape(-1), class_index, split, name=filepath)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-sample .npz feature folders (train/test, one subfolder per class) into a feature store")
+    parser.add_argument("train_folder", type=str)
+    parser.add_argument("test_folder", type=str)
+    parser.add_argument("store_path", type=str)
+    parser.add_argument("--key", type=str, default="flat", help="Array of each .npz file holding the feature vector")
+    args = parser.parse_args()
+    convert_folders(args.train_folder, args.test_folder, args.store_path, args.key)